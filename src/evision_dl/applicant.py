@@ -25,7 +25,11 @@ logger = logging.getLogger(__name__)
 
 ######################################################################
 
-class Applicant(namedtuple('Applicant', 'student_number surname preferred_name')):
+class Applicant(namedtuple(
+    'Applicant',
+    'student_number surname preferred_name given_name program intake_term',
+    defaults=(None, None, None),
+)):
     def __str__(self) -> str:
         return "Applicant {}, {} ({})".format(self.surname, self.preferred_name, self.student_number)
 
@@ -35,12 +39,23 @@ class ApplicantContextChangeEvent(Event):
     def __init__(self, applicant:Optional[Applicant]):
         self.applicant = applicant
 
+class ApplicantSkippedEvent(Event):
+    def __init__(self, applicant:Applicant):
+        self.applicant = applicant
+
+    def __str__(self) -> str:
+        return "Skipped {}: PDF already downloaded".format(self.applicant)
+
 ######################################################################
 
 class ApplicantContextChangeListener(EventListener):
+    event_types = (ApplicantContextChangeEvent, ApplicantSkippedEvent)
+
     def handle_event(self, robot: Robot, event: Event) -> None:
         if isinstance(event, ApplicantContextChangeEvent):
             if event.applicant is None:
                 logger.debug("Cleared applicant context")
             else:
                 logger.info(event.applicant)
+        elif isinstance(event, ApplicantSkippedEvent):
+            logger.info(event)
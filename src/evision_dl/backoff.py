@@ -0,0 +1,195 @@
+# Copyright 2003 Dara Poon and the University of British Columbia
+#
+# This file is part of evision-dl.
+#
+# evision-dl is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# evision-dl is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# evision-dl. If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Retrying of flaky operations, with exponential backoff and jitter, within a
+per-operation budget, and a circuit breaker that pauses all robots when
+failures pile up, so that a struggling eVision is not hammered.
+"""
+
+import functools
+import logging
+import random
+from threading import Event as ThreadingEvent, Lock
+import time
+from typing import Any, Callable, Optional, Tuple, Type, TypeVar, Union
+
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+F = TypeVar('F', bound=Callable[..., Any])
+
+######################################################################
+
+class CircuitBreaker:
+    """
+    Counts consecutive failures across all operations and robots.  Once
+    there are threshold of them, the circuit opens: every robot pauses before
+    its next attempt, for a period that doubles each time the circuit opens
+    again without an intervening success.
+    """
+
+    def __init__(self, threshold: int = 20, pause: float = 30, max_pause: float = 600):
+        self.threshold = threshold
+        self.pause = pause
+        self.max_pause = max_pause
+        self.lock = Lock()
+        self.consecutive_failures = 0
+        self.trips = 0
+        self.open_until = 0.0
+
+    def record_success(self) -> None:
+        with self.lock:
+            self.consecutive_failures = 0
+            self.trips = 0
+
+    def record_failure(self) -> None:
+        with self.lock:
+            self.consecutive_failures += 1
+            if self.consecutive_failures < self.threshold:
+                return
+            pause = min(self.pause * 2 ** self.trips, self.max_pause)
+            self.consecutive_failures = 0
+            self.trips += 1
+            self.open_until = time.monotonic() + pause
+        metrics.increment('circuit_breaker_trips_total')
+        logger.warning("{} consecutive failures; pausing for {:.3g} s".format(self.threshold, pause))
+
+    def wait(self, stop: Optional[ThreadingEvent] = None) -> None:
+        """
+        Block while the circuit is open, or until stop is set.
+        """
+        while (remaining := self.open_until - time.monotonic()) > 0:
+            with metrics.timer('circuit_breaker_pause_seconds'):
+                if stop is None:
+                    time.sleep(remaining)
+                elif stop.wait(remaining):
+                    return
+
+# The circuit breaker shared by all retry policies
+circuit_breaker = CircuitBreaker()
+
+######################################################################
+
+class RetryPolicy:
+    """
+    How often, and for how long, to retry an operation that raises one of
+    the given exceptions.  There are at most tries attempts (or unlimited, if
+    None), and no retry starts after budget seconds.  The delay before the
+    n-th retry is initial_delay * multiplier ** (n - 1), capped at max_delay,
+    and then reduced by a random fraction of up to jitter, so that robots
+    that failed together do not retry in lockstep.  Only exceptions for which
+    retryable() returns True are retried; others are re-raised at once.
+
+    A policy can be used as a decorator of Screen methods, or, for loops that
+    need to handle the exception themselves, through start().  Either way,
+    retrying stops once the robot is asked to stop.
+    """
+
+    def __init__(
+        self,
+        operation: str,
+        exceptions: Union[Type[BaseException], Tuple[Type[BaseException], ...]] = Exception,
+        tries: Optional[int] = None,
+        budget: float = float('inf'),
+        initial_delay: float = 0.1,
+        multiplier: float = 2,
+        max_delay: float = 10,
+        jitter: float = 0.5,
+        breaker: CircuitBreaker = circuit_breaker,
+        retryable: Callable[[BaseException], bool] = lambda e: True,
+    ):
+        self.operation = operation
+        self.exceptions = exceptions
+        self.tries = tries
+        self.budget = budget
+        self.initial_delay = initial_delay
+        self.multiplier = multiplier
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.breaker = breaker
+        self.retryable = retryable
+
+    def __call__(self, function: F) -> F:
+        @functools.wraps(function)
+        def wrapper(screen, *args, **kwargs):
+            return self.call(function, screen, *args, stop=screen.robot.stop_requested, **kwargs)
+        return wrapper      # type: ignore
+
+    def call(self, function: Callable[..., Any], *args: Any, stop: Optional[ThreadingEvent] = None, **kwargs: Any) -> Any:
+        retry = self.start(stop)
+        while True:
+            try:
+                result = function(*args, **kwargs)
+            except self.exceptions as e:
+                retry.failed(e)
+            else:
+                retry.succeeded()
+                return result
+
+    def start(self, stop: Optional[ThreadingEvent] = None) -> 'Retry':
+        self.breaker.wait(stop)
+        return Retry(self, stop)
+
+    def delay(self, retries: int) -> float:
+        delay = min(self.initial_delay * self.multiplier ** (retries - 1), self.max_delay)
+        return delay * (1 - random.uniform(0, self.jitter))
+
+class Retry:
+    """
+    The state of one operation being retried according to a RetryPolicy.
+    """
+
+    def __init__(self, policy: RetryPolicy, stop: Optional[ThreadingEvent] = None):
+        self.policy = policy
+        self.stop = stop
+        self.attempts = 1
+        self.deadline = time.monotonic() + policy.budget
+
+    def succeeded(self) -> None:
+        self.policy.breaker.record_success()
+
+    def failed(self, exception: BaseException, backoff: bool = True) -> None:
+        """
+        Record that the attempt failed with the exception, then either wait
+        before the next attempt, or, if the budget is spent or stop is set,
+        re-raise it.  The caller may skip the wait if it has already dealt
+        with the cause, in which case the failure doesn't count toward
+        tripping the circuit breaker.
+        """
+        policy = self.policy
+        if not policy.retryable(exception):
+            raise exception
+        if backoff:
+            policy.breaker.record_failure()
+        delay = policy.delay(self.attempts) if backoff else 0.0
+        if (
+            (policy.tries is not None and self.attempts >= policy.tries)
+            or time.monotonic() + delay > self.deadline
+            or (self.stop is not None and self.stop.is_set())
+        ):
+            metrics.increment('retries_exhausted_total', operation=policy.operation)
+            logger.debug("Giving up on {} after {} attempts".format(policy.operation, self.attempts))
+            raise exception
+        metrics.increment('retries_total', operation=policy.operation)
+        logger.debug("Retrying {} in {:.2f} s after {}".format(policy.operation, delay, type(exception).__name__))
+        if self.stop is None:
+            time.sleep(delay)
+        elif self.stop.wait(delay):
+            raise exception
+        policy.breaker.wait(self.stop)
+        self.attempts += 1
@@ -0,0 +1,226 @@
+# Copyright 2003 Dara Poon and the University of British Columbia
+#
+# This file is part of evision-dl.
+#
+# evision-dl is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# evision-dl is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# evision-dl. If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Measure the robot's throughput by driving headless Firefox through a folder of
+made-up applicants served by a local stand-in for eVision, or, with
+--simulate, by driving simulated browsers in memory.
+"""
+
+import argparse
+from collections import Counter
+import functools
+import logging
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, List, Sequence, Tuple
+
+from ..applicant import ApplicantContextChangeEvent, ApplicantSkippedEvent
+from ..download import (
+    Downloader,
+    PDFDownloadFailureEvent,
+    PDFDownloadSuccessEvent,
+    PDFGenerationCaveatEvent,
+    PDFGenerationFailureEvent,
+    PDFGenerationSuccessEvent,
+)
+from ..event import Event, EventListener
+from ..main import launch_firefox
+from ..metrics import metrics
+from ..robot import Robot
+from ..screen import Screen
+from ..screen.start import StartScreen
+from ..session import HTTPSession
+from ..workers import run_workers
+from .server import FakeEVision, make_applicants
+from .webdriver import SimulatedWebDriver
+
+logger = logging.getLogger(__name__)
+
+class ThroughputRecorder(EventListener):
+    """
+    Measures the time from the start of each applicant until its outcome is
+    final, including the background download, unless there are no
+    downloads, in which case generating the PDF is final.
+    """
+
+    event_types = (
+        ApplicantContextChangeEvent,
+        ApplicantSkippedEvent,
+        PDFGenerationCaveatEvent,
+        PDFGenerationFailureEvent,
+        PDFGenerationSuccessEvent,
+        PDFDownloadFailureEvent,
+        PDFDownloadSuccessEvent,
+    )
+
+    def __init__(self, downloads: bool = True):
+        self.downloads = downloads
+        self.start_times: Dict[str, float] = {}
+        self.current_students: Dict[Robot, str] = {}
+        self.latencies: List[float] = []
+        self.outcomes: Counter = Counter()
+
+    def handle_event(self, robot: Robot, event: Event) -> None:
+        if isinstance(event, ApplicantContextChangeEvent):
+            if event.applicant is None:
+                self.current_students.pop(robot, None)
+            else:
+                self.current_students[robot] = event.applicant.student_number
+                self.start_times[event.applicant.student_number] = time.monotonic()
+        elif isinstance(event, ApplicantSkippedEvent):
+            self.outcomes['skipped'] += 1
+        elif isinstance(event, PDFGenerationCaveatEvent):
+            self.outcomes['caveats'] += 1
+        elif isinstance(event, PDFGenerationFailureEvent):
+            self._done(self.current_students.get(robot), 'generation failed')
+        elif isinstance(event, PDFGenerationSuccessEvent):
+            if not self.downloads:
+                self._done(self.current_students.get(robot), 'generated')
+        elif isinstance(event, PDFDownloadFailureEvent):
+            self._done(event.applicant.student_number, 'download failed')
+        elif isinstance(event, PDFDownloadSuccessEvent):
+            self._done(event.applicant.student_number, 'downloaded')
+
+    def _done(self, student_number, outcome: str) -> None:
+        self.outcomes[outcome] += 1
+        if (start_time := self.start_times.pop(student_number, None)) is not None:
+            self.latencies.append(time.monotonic() - start_time)
+
+def percentiles(values: Sequence[float]) -> str:
+    if not values:
+        return "no samples"
+    if len(values) == 1:
+        p50 = p95 = values[0]
+    else:
+        cuts = statistics.quantiles(values, n=100, method='inclusive')
+        p50, p95 = cuts[49], cuts[94]
+    return "p50 {:.3g} s, p95 {:.3g} s, max {:.3g} s".format(p50, p95, max(values))
+
+def run_robots(drivers: Sequence[Any], start_screen: Callable[[Robot], Screen], listeners: Sequence[EventListener]) -> Tuple[int, float]:
+    robot = Robot(drivers[0])
+    robots = [robot] + [robot.spawn(driver) for driver in drivers[1:]]
+    for listener in listeners:
+        robot.add_event_listener(listener)
+    start_time = time.monotonic()
+    if len(robots) == 1:
+        status = robot.run(start_screen)
+    else:
+        status = run_workers(robots, start_screen)
+    return status, time.monotonic() - start_time
+
+def main(*argv: str) -> int:
+    parser = argparse.ArgumentParser(prog='python -m evision_dl.bench', description=__doc__)
+    parser.add_argument('--applicants', metavar='N', type=int, default=20)
+    parser.add_argument('--browsers', metavar='N', type=int, default=1)
+    parser.add_argument('--simulate', action='store_true',
+        help='Drive simulated browsers in memory, without Firefox, the server, or downloads, and count WebDriver calls')
+    parser.add_argument('--page-latency', metavar='SECONDS', type=float, default=0.05,
+        help='Delay before the server responds to each request')
+    parser.add_argument('--tab-latency', metavar='SECONDS', type=float, default=0.2,
+        help='Time for which a "Processing" overlay obscures the page after a tab is clicked')
+    parser.add_argument('--overlay-rate', metavar='P', type=float, default=0.0,
+        help='With --simulate, probability that clicking a tab brings up a "Processing" overlay')
+    parser.add_argument('--merge-latency', metavar='SECONDS', type=float, default=0.1,
+        help='Time to merge each document into the PDF')
+    parser.add_argument('--failure-rate', metavar='P', type=float, default=0.02,
+        help='Probability that a PDF merge fails with an error')
+    parser.add_argument('--bad-doc-rate', metavar='P', type=float, default=0.05,
+        help='Probability that a document breaks PDF merges')
+    parser.add_argument('--pdf-size', metavar='BYTES', type=int, default=1 << 20)
+    parser.add_argument('--download-workers', metavar='N', type=int, default=2)
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--show-browser', action='store_true',
+        help='Run Firefox with a window, rather than headless')
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args(argv or sys.argv[1:])
+    if args.applicants < 1:
+        parser.error("--applicants must be at least 1")
+
+    logging.basicConfig(
+        level=logging.DEBUG if args.verbose else logging.WARNING if args.simulate else logging.INFO,
+        style='{',
+        format="{asctime}s [{levelname}] {threadName} @{name} {message:.1200}",
+    )
+
+    browsers = max(1, args.browsers)
+    recorder = ThroughputRecorder(downloads=not args.simulate)
+    if args.simulate:
+        applicants = make_applicants(args.applicants, args.bad_doc_rate, random.Random(args.seed))
+        drivers: List[Any] = [
+            SimulatedWebDriver(applicants, failure_rate=args.failure_rate, overlay_rate=args.overlay_rate, seed=args.seed)
+            for _ in range(browsers)
+        ]
+        status, elapsed = run_robots(drivers, StartScreen, [recorder])
+    else:
+        fake = FakeEVision(
+            applicants=args.applicants,
+            page_latency=args.page_latency,
+            tab_latency=args.tab_latency,
+            merge_latency=args.merge_latency,
+            failure_rate=args.failure_rate,
+            bad_doc_rate=args.bad_doc_rate,
+            pdf_size=args.pdf_size,
+            seed=args.seed,
+        )
+        drivers = [launch_firefox(os.devnull, headless=not args.show_browser) for _ in range(browsers)]
+        try:
+            with tempfile.TemporaryDirectory() as dest_dir:
+                downloader = Downloader(
+                    dest_dir,
+                    workers=args.download_workers,
+                    session=HTTPSession(max_connections_per_host=args.download_workers),
+                )
+                status, elapsed = run_robots(drivers, functools.partial(StartScreen, url=fake.start_url), [downloader, recorder])
+        finally:
+            for driver in drivers:
+                driver.quit()
+            fake.close()
+
+    done = sum(recorder.outcomes[o] for o in ('generated', 'downloaded', 'download failed', 'generation failed', 'skipped'))
+    print("Processed {} applicants in {:.3g} s: {:.1f} per minute".format(done, elapsed, 60 * done / elapsed))
+    print("Outcomes: {}".format(dict(recorder.outcomes)))
+    print("Per-applicant latency: {}".format(percentiles(recorder.latencies)))
+    with metrics.lock:
+        screens = metrics.histograms.get('screen_seconds', {})
+        for labels, histogram in sorted(screens.items()):
+            print("  {:<36} n={:<5} p50 {:.3g} s, p95 {:.3g} s, max {:.3g} s".format(
+                dict(labels)['screen'], histogram.count, histogram.quantile(0.5), histogram.quantile(0.95), histogram.max
+            ))
+        for name in ('retries_total', 'retries_exhausted_total', 'circuit_breaker_trips_total'):
+            for labels, value in sorted(metrics.counters.get(name, {}).items()):
+                print("  {:<36} {:g}".format(' '.join([name] + [v for _, v in labels]), value))
+    if args.simulate:
+        # Empty if the robots crashed before reaching any applicant
+        per_applicant = [
+            sum(calls.values())
+            for driver in drivers
+            for calls in driver.calls_by_applicant.values()
+        ]
+        totals: Counter = sum((driver.calls for driver in drivers), Counter())
+        if not per_applicant:
+            return status
+        print("WebDriver calls per applicant: mean {:.1f}, max {}".format(statistics.mean(per_applicant), max(per_applicant)))
+        for command, count in totals.most_common():
+            print("  {:<36} {:.2f} per applicant".format(command, count / len(per_applicant)))
+    return status
+
+if __name__ == '__main__':
+    sys.exit(main() or 0)
@@ -0,0 +1,377 @@
+# Copyright 2003 Dara Poon and the University of British Columbia
+#
+# This file is part of evision-dl.
+#
+# evision-dl is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# evision-dl is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# evision-dl. If not, see <https://www.gnu.org/licenses/>.
+
+"""
+A local stand-in for eVision, serving just enough of the application window,
+the Manage Applicant PDF window, and the PDF downloads for the screens to work
+through a folder of made-up applicants.
+"""
+
+from collections import namedtuple
+from html import escape
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import logging
+import random
+import re
+from threading import Thread
+import time
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlencode, urlsplit
+import uuid
+
+logger = logging.getLogger(__name__)
+
+######################################################################
+
+FakeDocument = namedtuple('FakeDocument', 'value label bad')
+
+FakeApplicant = namedtuple('FakeApplicant', 'student_number surname given_name program docs')
+
+DOC_TYPES = (
+    "Reference Letter",
+    "Transcripts & Diplomas  - Unofficial",
+    "CV/Resume",
+    "Statement of Intent",
+    "Passport",
+    "Language Proficiency Test Results",
+    "GRE Scores",
+)
+
+# Tabs of the application window, in order; the first is selected initially
+TABS = ("Application\xa0Details", "Personal\xa0Details", "GPO", "Application\xa0Utilities")
+
+SURNAMES = ("Smith", "Nguyen", "Li", "Garcia", "Singh", "Tremblay", "O'Brien", "Müller")
+GIVEN_NAMES = ("Alex", "Jordan", "Mei", "Priya", "Sam", "Élodie", "Kofi", "Ana")
+
+def make_applicants(count: int, bad_doc_rate: float = 0.0, rng: Optional[random.Random] = None) -> List[FakeApplicant]:
+    """
+    Applicants with a random selection of documents, each of which breaks PDF
+    merges with probability bad_doc_rate (Language Proficiency and GRE
+    documents always do).
+    """
+    rng = rng or random.Random()
+    return [
+        FakeApplicant(
+            '{:08d}'.format(31000000 + i),
+            rng.choice(SURNAMES),
+            rng.choice(GIVEN_NAMES),
+            "Doctor of Philosophy",
+            [
+                FakeDocument(
+                    'MHD:{:05d}'.format(i * 100 + j),
+                    "{} (file{}.pdf, 21/Dec/2022)".format(doc_type, j),
+                    doc_type.startswith(("Language Proficiency", "GRE")) or rng.random() < bad_doc_rate,
+                )
+                for j, doc_type in enumerate(rng.sample(DOC_TYPES, rng.randint(2, len(DOC_TYPES))))
+            ],
+        )
+        for i in range(count)
+    ]
+
+def personal_details(applicant: FakeApplicant) -> List[Tuple[str, str]]:
+    """
+    The labelled cells of the Personal Details tab.
+    """
+    return [
+        ("Family Name(Surname):", applicant.surname),
+        ("Given Name:", applicant.given_name),
+        ("Preferred Name:", ""),
+        ("Program:", applicant.program),
+        ("Intake Term:", "2023W"),
+    ]
+
+def make_pdf(pages: int = 1, padding: int = 0) -> bytes:
+    """
+    A valid, unencrypted PDF with the given number of blank pages, padded with
+    a comment in the first page's content stream to make it bigger.
+    """
+    objects = [
+        b'<< /Type /Catalog /Pages 2 0 R >>',
+        b'<< /Type /Pages /Kids [' + b' '.join(b'%d 0 R' % (3 + 2 * i) for i in range(pages)) + b'] /Count %d >>' % pages,
+    ]
+    for i in range(pages):
+        content = b'%' + b'x' * padding + b'\n' if i == 0 and padding else b''
+        objects.append(b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents %d 0 R >>' % (4 + 2 * i))
+        objects.append(b'<< /Length %d >>\nstream\n' % len(content) + content + b'\nendstream')
+    pdf = bytearray(b'%PDF-1.4\n')
+    offsets = []
+    for n, obj in enumerate(objects, 1):
+        offsets.append(len(pdf))
+        pdf += b'%d 0 obj\n' % n + obj + b'\nendobj\n'
+    xref = len(pdf)
+    pdf += b'xref\n0 %d\n0000000000 65535 f \n' % (len(objects) + 1)
+    pdf += b''.join(b'%010d 00000 n \n' % offset for offset in offsets)
+    pdf += b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (len(objects) + 1, xref)
+    return bytes(pdf)
+
+######################################################################
+
+class FakeEVision:
+    """
+    Serves a folder of randomly generated applicants at http://127.0.0.1:port/
+    on a background thread.  Start the robot at start_url.
+
+    Latencies are in seconds.  page_latency delays every response;
+    tab_latency is how long a "Processing" overlay obscures the application
+    window after a tab is clicked; merge_latency is the time to merge each
+    document into a PDF.  Each merge fails with an error with probability
+    failure_rate.
+    """
+
+    DOC_FIELD = 'ANSWER.TTQ.MENSYS.4'
+    COOKIE = 'SITS_SESSION'
+
+    def __init__(
+        self,
+        applicants: int = 10,
+        port: int = 0,
+        page_latency: float = 0.05,
+        tab_latency: float = 0.2,
+        merge_latency: float = 0.1,
+        failure_rate: float = 0.0,
+        bad_doc_rate: float = 0.05,
+        pdf_size: int = 1 << 20,
+        seed: Optional[int] = None,
+    ):
+        self.page_latency = page_latency
+        self.tab_latency = tab_latency
+        self.merge_latency = merge_latency
+        self.failure_rate = failure_rate
+        self.random = random.Random(seed)
+        self.applicants = make_applicants(applicants, bad_doc_rate, self.random)
+        self.pdf = make_pdf(padding=pdf_size)
+        self.session_id = uuid.uuid4().hex
+
+        fake = self
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self) -> None:
+                fake._handle(self)
+
+            def log_message(self, format: str, *args) -> None:
+                logger.debug(format % args)
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+        self.server.daemon_threads = True
+        self.thread = Thread(target=self.server.serve_forever, name='fake-evision', daemon=True)
+        self.thread.start()
+
+    @property
+    def url(self) -> str:
+        return 'http://127.0.0.1:{}/'.format(self.server.server_port)
+
+    @property
+    def start_url(self) -> str:
+        return self.url + 'application/0'
+
+    def close(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+    ##################################################################
+
+    ROUTES = [
+        (re.compile(r'^/$'), '_folder'),
+        (re.compile(r'^/application/(\d+)$'), '_application'),
+        (re.compile(r'^/pdf/(\d+)$'), '_doc_list'),
+        (re.compile(r'^/pdf/(\d+)/order$'), '_order'),
+        (re.compile(r'^/pdf/(\d+)/result$'), '_result'),
+        (re.compile(r'^/download/(\d+)$'), '_download'),
+    ]
+
+    def _handle(self, handler: BaseHTTPRequestHandler) -> None:
+        time.sleep(self.page_latency)
+        url = urlsplit(handler.path)
+        query = parse_qs(url.query)
+        for pattern, method in self.ROUTES:
+            if match := pattern.match(url.path):
+                args = [int(g) for g in match.groups()]
+                if args and args[0] >= len(self.applicants):
+                    break
+                getattr(self, method)(handler, query, *args)
+                return
+        self._send(handler, 404, 'text/plain', b'Not found')
+
+    def _send(self, handler: BaseHTTPRequestHandler, status: int, content_type: str, body: bytes, headers: Dict[str, str] = {}) -> None:
+        handler.send_response(status)
+        handler.send_header('Content-Type', content_type)
+        handler.send_header('Content-Length', str(len(body)))
+        for name, value in headers.items():
+            handler.send_header(name, value)
+        handler.end_headers()
+        handler.wfile.write(body)
+
+    def _send_page(self, handler: BaseHTTPRequestHandler, title: str, body: str) -> None:
+        html = '<!DOCTYPE html>\n<html><head><meta charset="utf-8"><title>{}</title></head><body>\n{}\n</body></html>'.format(escape(title), body)
+        self._send(handler, 200, 'text/html; charset=utf-8', html.encode('utf-8'), {
+            'Set-Cookie': '{}={}; Path=/'.format(self.COOKIE, self.session_id),
+        })
+
+    def _selected_docs(self, query: Dict[str, List[str]]) -> List[str]:
+        return query.get(self.DOC_FIELD, [])
+
+    ##################################################################
+
+    def _folder(self, handler: BaseHTTPRequestHandler, query: Dict[str, List[str]]) -> None:
+        self._send_page(handler, "Folder", '<a href="/application/0" target="_blank">Open the first application</a>')
+
+    def _application(self, handler: BaseHTTPRequestHandler, query: Dict[str, List[str]], i: int) -> None:
+        applicant = self.applicants[i]
+        tab_list = ''.join(
+            '<li role="tab" title="{0}" aria-selected="{1}"><a href="#" onclick="return selectTab({2})">{0}</a></li>'.format(
+                escape(title), 'true' if n == 0 else 'false', n
+            )
+            for n, title in enumerate(TABS)
+        )
+        panels = [
+            '<p>Program: {}</p>'.format(escape(applicant.program)),
+            '<h3>Student No: {}</h3><table>'.format(applicant.student_number) + ''.join(
+                '<tr><td><strong>{}</strong> {}</td></tr>'.format(escape(label), escape(value))
+                for label, value in personal_details(applicant)
+            ) + '</table>',
+            '<p>Graduate Program Office</p>',
+            '<input type="button" value="Manage Applicant PDF" onclick="window.open(\'/pdf/{}\', \'_blank\')">'.format(i),
+        ]
+        body = '''
+<style>
+  .panel {{ display: none; }}
+  .panel.active {{ display: block; }}
+  .ui-dialog {{ position: fixed; top: 0; left: 0; width: 100%; height: 100%; background: rgba(0, 0, 0, 0.3); }}
+</style>
+<ul>{tabs}</ul>
+{panels}
+<div>
+  <input type="button" value="Save">
+  <form method="get" action="/application/{next}" style="display: inline">
+    <input type="submit" value="Next Applicant"{disabled}>
+  </form>
+</div>
+<script>
+function selectTab(n) {{
+  var dialog = document.createElement('div');
+  dialog.className = 'ui-dialog';
+  dialog.innerHTML = '<span class="ui-dialog-title">Processing</span><div class="ui-dialog-content">Please wait</div><div class="ui-dialog-buttonset"></div>';
+  document.body.appendChild(dialog);
+  setTimeout(function () {{
+    document.querySelectorAll('li[role="tab"]').forEach(function (li, i) {{
+      li.setAttribute('aria-selected', i === n ? 'true' : 'false');
+    }});
+    document.querySelectorAll('.panel').forEach(function (panel, i) {{
+      panel.className = i === n ? 'panel active' : 'panel';
+    }});
+    dialog.remove();
+  }}, {tab_latency});
+  return false;
+}}
+</script>'''.format(
+            tabs=tab_list,
+            panels='\n'.join(
+                '<div class="panel{}">{}</div>'.format(' active' if n == 0 else '', panel)
+                for n, panel in enumerate(panels)
+            ),
+            next=i + 1,
+            disabled=' disabled' if i + 1 >= len(self.applicants) else '',
+            tab_latency=int(self.tab_latency * 1000),
+        )
+        self._send_page(handler, "Graduate Admissions Decision Processing", body)
+
+    def _doc_list(self, handler: BaseHTTPRequestHandler, query: Dict[str, List[str]], i: int) -> None:
+        # Like eVision, render the documents as a <select>, then replace it
+        # with checkboxes after a moment
+        applicant = self.applicants[i]
+        options = ''.join(
+            '<option value="{}">{}</option>'.format(escape(doc.value), escape(doc.label))
+            for doc in applicant.docs
+        )
+        body = '''
+<div id="sitspagecontent"><form method="get" action="/pdf/{i}/order">
+<div><div id="pdf_doc_list">
+  <label class="pdf-check">
+    <input type="checkbox" onclick="document.querySelectorAll('#pdf_doc_list input[type=checkbox]').forEach(function (c) {{ c.checked = this.checked; }}, this);" checked="checked">Select all documents
+  </label>
+  <select name="{field}" id="{field}" multiple="multiple" class="sv-form-control">{options}</select>
+  <input type="hidden" name="DUM_FIXT.TTQ.MENSYS.4">
+</div></div><br>
+<div><div>
+  <input type="button" class="btn" value="EXIT" onclick="self.close()">
+  <input type="submit" name="ANSWER.TTQ.MENSYS.5" value="CONTINUE" class="btn">
+</div></div>
+</form></div>
+<script>
+setTimeout(function () {{
+  var select = document.getElementById('{field}');
+  var after = document.getElementsByName('DUM_FIXT.TTQ.MENSYS.4')[0];
+  Array.prototype.forEach.call(select.options, function (option) {{
+    var label = document.createElement('label');
+    label.className = 'pdf-check';
+    var checkbox = document.createElement('input');
+    checkbox.type = 'checkbox';
+    checkbox.name = select.name;
+    checkbox.value = option.value;
+    checkbox.checked = true;
+    label.appendChild(checkbox);
+    label.appendChild(document.createTextNode(option.text));
+    after.parentNode.insertBefore(label, after.nextSibling);
+    after = label;
+  }});
+  select.style.display = 'none';
+  select.disabled = true;
+}}, {delay});
+</script>'''.format(i=i, field=self.DOC_FIELD, options=options, delay=int(self.page_latency * 1000))
+        self._send_page(handler, "Manage Applicant PDF", body)
+
+    def _order(self, handler: BaseHTTPRequestHandler, query: Dict[str, List[str]], i: int) -> None:
+        hidden = ''.join(
+            '<input type="hidden" name="{}" value="{}">'.format(self.DOC_FIELD, escape(value))
+            for value in self._selected_docs(query)
+        )
+        body = '''
+<div id="sitspagecontent"><form method="get" action="/pdf/{i}/result">
+  <h2>Select order of Document Types</h2>
+  {hidden}
+  <input type="button" class="btn" value="BACK" onclick="location.href = '/pdf/{i}'">
+  <input type="button" class="btn" value="EXIT" onclick="self.close()">
+  <input type="submit" value="CONTINUE" class="btn">
+</form></div>'''.format(i=i, hidden=hidden)
+        self._send_page(handler, "Manage Applicant PDF", body)
+
+    def _result(self, handler: BaseHTTPRequestHandler, query: Dict[str, List[str]], i: int) -> None:
+        applicant = self.applicants[i]
+        selected = self._selected_docs(query)
+        time.sleep(self.merge_latency * len(selected))
+        buttons = '''
+<input type="button" class="btn" value="BACK" onclick="location.href = '/pdf/{}/order?{}'">
+<input type="button" class="btn" value="EXIT" onclick="self.close()">'''.format(i, escape(urlencode([(self.DOC_FIELD, v) for v in selected])))
+        if self.random.random() < self.failure_rate:
+            content = '''<div class="span12"><font color="red">Error:</font>
+  There has been a processing error. Please try again or contact IT support for assistance and quote the following details:
+  <br>Error ID: -3013<br>Application ID: {}|01|01.</div>'''.format(applicant.student_number)
+        elif any(doc.bad for doc in applicant.docs if doc.value in selected):
+            # INC1040643
+            content = '<div>Please to download a copy of the document</div>'
+        else:
+            content = '<div>Please <a href="/download/{}?{}">click here</a> to download a copy of the document</div>'.format(
+                i, escape(urlencode([(self.DOC_FIELD, v) for v in selected]))
+            )
+        self._send_page(handler, "Manage Applicant PDF", '<div id="sitspagecontent">{}{}</div>'.format(content, buttons))
+
+    def _download(self, handler: BaseHTTPRequestHandler, query: Dict[str, List[str]], i: int) -> None:
+        # eVision rejects requests that are not part of the browser's session
+        if '{}={}'.format(self.COOKIE, self.session_id) not in (handler.headers.get('Cookie') or ''):
+            self._send(handler, 403, 'text/plain', b'No session')
+            return
+        self._send(handler, 200, 'application/pdf', self.pdf)
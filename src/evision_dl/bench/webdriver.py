@@ -0,0 +1,460 @@
+# Copyright 2003 Dara Poon and the University of British Columbia
+#
+# This file is part of evision-dl.
+#
+# evision-dl is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# evision-dl is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# evision-dl. If not, see <https://www.gnu.org/licenses/>.
+
+"""
+An in-memory stand-in for a WebDriver browsing eVision, so that the screens
+can be run without Firefox, thousands of applicants per second, counting the
+WebDriver calls that each applicant costs.
+
+Rather than interpreting HTML and JavaScript, the simulated driver models the
+pages that the screens visit, answers the locators that the screens use, and
+recognizes the scripts that they run.  A locator or script that it doesn't
+recognize raises WebDriverException, so that changes to the screens that the
+model hasn't caught up with are noticed.
+"""
+
+from collections import Counter
+import random
+import time
+from typing import Any, Callable, Dict, List, Optional, Sequence, Set, Tuple
+import uuid
+
+from selenium.common.exceptions import (
+    ElementClickInterceptedException,
+    ElementNotInteractableException,
+    NoSuchElementException,
+    NoSuchWindowException,
+    StaleElementReferenceException,
+    WebDriverException,
+)
+from selenium.webdriver.common.by import By
+
+from .. import expected_conditions as EVEC
+from ..screen import SNAPSHOT_SCRIPT
+from ..screen.application_details import ApplicationDetailsScreen
+from ..screen.application_done import ApplicationDoneScreen
+from ..screen.gpo import GPOScreen
+from ..screen.request_pdf import RequestPDFScreen
+from ..screen.request_pdf_trouble import RequestPDFTroubleshootingScreen
+from ..xpath import string_literal as xpath_string
+from .server import TABS, FakeApplicant, FakeEVision, personal_details
+
+Locator = Tuple[str, str]
+
+RED_FONT = (By.XPATH, '//*[font[@color="red"]]')
+CLICK_HERE = (By.LINK_TEXT, "click here")
+CONTENT_DIV = (By.CSS_SELECTOR, '#sitspagecontent div')
+
+def tab_xpath(title: str) -> str:
+    return '//li[@role="tab"][@title={}]'.format(xpath_string(title))
+
+######################################################################
+
+class SimulatedElement:
+    def __init__(self, page: 'Page', locators: Set[Locator], text: str = '', attributes: Dict[str, str] = {}, on_click: Optional[Callable[[], None]] = None, overlay: bool = False):
+        self.page = page
+        self.locators = locators
+        self._text = text
+        self.attributes = attributes
+        self.on_click = on_click
+        self.overlay = overlay
+
+    @property
+    def attached(self) -> bool:
+        return self.page.attached and (not self.overlay or self.page.overlay is self)
+
+    def _check(self, command: str) -> None:
+        self.page.driver._count(command)
+        if not self.attached:
+            raise StaleElementReferenceException("Element is no longer attached to the DOM")
+
+    @property
+    def text(self) -> str:
+        self._check('getElementText')
+        return self._text
+
+    def get_attribute(self, name: str) -> Optional[str]:
+        self._check('getElementAttribute')
+        return self.attributes.get(name)
+
+    def is_enabled(self) -> bool:
+        self._check('isElementEnabled')
+        return True
+
+    def click(self) -> None:
+        self._check('clickElement')
+        self.page.click(self)
+
+######################################################################
+
+class Page:
+    title = ''
+
+    def __init__(self, driver: 'SimulatedWebDriver', i: int):
+        self.driver = driver
+        self.i = i
+        self.handle: Optional[str] = None
+        self.overlay: Optional[SimulatedElement] = None
+
+    @property
+    def applicant(self) -> FakeApplicant:
+        return self.driver.applicants[self.i]
+
+    @property
+    def attached(self) -> bool:
+        return self.handle is not None and self.driver.windows.get(self.handle) is self
+
+    def elements(self) -> List[SimulatedElement]:
+        return [SimulatedElement(self, {(By.TAG_NAME, 'html'), (By.CSS_SELECTOR, 'body')}, self.title)]
+
+    def element(self, locator: Locator, text: str = '', **kwargs) -> SimulatedElement:
+        return SimulatedElement(self, {locator}, text, **kwargs)
+
+    def click(self, element: SimulatedElement) -> None:
+        if self.overlay is not None and element is not self.overlay:
+            raise ElementClickInterceptedException("Element is obscured by a modal overlay")
+        if element.on_click:
+            element.on_click()
+
+    def navigate(self, page: 'Page') -> None:
+        assert self.handle is not None
+        self.driver._load(self.handle, page)
+
+class ApplicationPage(Page):
+    title = "Graduate Admissions Decision Processing"
+
+    def __init__(self, driver: 'SimulatedWebDriver', i: int):
+        super().__init__(driver, i)
+        self.tab = 0
+
+    def elements(self) -> List[SimulatedElement]:
+        elements = super().elements()
+        for n, title in enumerate(TABS):
+            elements.append(self.element((By.XPATH, tab_xpath(title) + '/a'), title, on_click=lambda n=n: self.select_tab(n)))
+        elements.append(self.element((By.XPATH, tab_xpath(TABS[self.tab]) + '[@aria-selected="true"]'), TABS[self.tab]))
+        elements.append(self.element(GPOScreen.MANAGE_PDF_BUTTON, on_click=self.manage_pdf))
+        elements.append(self.element(ApplicationDoneScreen.SAVE_BUTTON))
+        if self.i + 1 < len(self.driver.applicants):
+            elements.append(self.element(ApplicationDoneScreen.NEXT_APPLICANT_BUTTON, on_click=lambda: self.navigate(ApplicationPage(self.driver, self.i + 1))))
+        return elements
+
+    def select_tab(self, n: int) -> None:
+        self.tab = n
+        if self.driver.random.random() < self.driver.overlay_rate:
+            # A "Processing" overlay that obscures the page until the robot
+            # waits for it to disappear
+            self.overlay = self.element((By.CSS_SELECTOR, 'div.ui-dialog .ui-dialog-title'), "Processing", overlay=True)
+
+    def manage_pdf(self) -> None:
+        if TABS[self.tab] != "Application\xa0Utilities":
+            raise ElementNotInteractableException("Manage Applicant PDF button is not visible")
+        self.driver._open(DocListPage(self.driver, self.i))
+
+class PDFPage(Page):
+    title = "Manage Applicant PDF"
+
+    def elements(self) -> List[SimulatedElement]:
+        return super().elements() + [self.element(RequestPDFScreen.EXIT_BUTTON, on_click=self.exit)]
+
+    def exit(self) -> None:
+        assert self.handle is not None
+        self.driver._close(self.handle)
+
+class DocListPage(PDFPage):
+    def __init__(self, driver: 'SimulatedWebDriver', i: int):
+        super().__init__(driver, i)
+        self.checked = {doc.value: True for doc in self.applicant.docs}
+
+    def elements(self) -> List[SimulatedElement]:
+        return super().elements() + [
+            self.element(RequestPDFScreen.CONTINUE_BUTTON, on_click=lambda: self.navigate(OrderPage(self.driver, self.i, self.selected()))),
+            self.element((By.XPATH, RequestPDFScreen._doc_checkbox_list_xpath())),
+        ]
+
+    def selected(self) -> List[str]:
+        return [value for value, checked in self.checked.items() if checked]
+
+    def docs(self) -> List[Dict[str, Any]]:
+        return [
+            {'id': FakeEVision.DOC_FIELD + '"' + doc.value, 'label': doc.label, 'checked': self.checked[doc.value], 'italic': False}
+            for doc in self.applicant.docs
+        ]
+
+    def select_docs(self, checked: bool, ids: Sequence[str], substrings: Sequence[str], others: Optional[bool]) -> List[Dict[str, Any]]:
+        # Like RequestPDFScreen.SELECT_DOCS_SCRIPT
+        for doc in self.docs():
+            value = doc['id'].partition('"')[2]
+            if doc['id'] in ids or any(s in doc['label'] for s in substrings):
+                self.checked[value] = checked
+            elif others is not None:
+                self.checked[value] = others
+        return self.docs()
+
+class OrderPage(PDFPage):
+    def __init__(self, driver: 'SimulatedWebDriver', i: int, selected: List[str]):
+        super().__init__(driver, i)
+        self.selected = selected
+
+    def elements(self) -> List[SimulatedElement]:
+        return super().elements() + [
+            self.element(RequestPDFScreen.BACK_BUTTON, on_click=lambda: self.navigate(DocListPage(self.driver, self.i))),
+            self.element(RequestPDFScreen.CONTINUE_BUTTON, on_click=lambda: self.navigate(ResultPage(self.driver, self.i, self.selected))),
+        ]
+
+class ResultPage(PDFPage):
+    def __init__(self, driver: 'SimulatedWebDriver', i: int, selected: List[str]):
+        super().__init__(driver, i)
+        self.selected = selected
+        if driver.random.random() < driver.failure_rate:
+            self.outcome = 'error'
+        elif any(doc.bad for doc in self.applicant.docs if doc.value in selected):
+            # INC1040643
+            self.outcome = 'merge failed'
+        else:
+            self.outcome = 'success'
+
+    def elements(self) -> List[SimulatedElement]:
+        elements = super().elements() + [
+            self.element(RequestPDFScreen.BACK_BUTTON, on_click=lambda: self.navigate(OrderPage(self.driver, self.i, self.selected))),
+            self.element(CONTENT_DIV),
+        ]
+        if self.outcome == 'error':
+            elements.append(self.element(RED_FONT, "Error: There has been a processing error.\nError ID: -3013"))
+        elif self.outcome == 'success':
+            elements.append(self.element(CLICK_HERE, "click here", attributes={'href': 'https://evision.invalid/download/{}'.format(self.i)}))
+        return elements
+
+######################################################################
+
+class SimulatedWebDriver:
+    """
+    A WebDriver whose browser shows a folder of made-up applicants, as
+    generated by make_applicants(), opened at the first applicant.
+
+    Each merge fails with an error with probability failure_rate, and each
+    click on a tab brings up a "Processing" overlay with probability
+    overlay_rate.  Calls are counted in calls, by command, and in
+    calls_by_applicant, by the student number of the applicant whose
+    application window is open.
+    """
+
+    # A 1×1 transparent image
+    BLANK_PNG = bytes.fromhex(
+        '89504e470d0a1a0a0000000d4948445200000001000000010806000000'
+        '1f15c4890000000b4944415478da636000020000050001e9fadcd80000'
+        '000049454e44ae426082'
+    )
+
+    USER_AGENT = 'Mozilla/5.0 (X11; Linux x86_64; rv:109.0) Gecko/20100101 Firefox/115.0 (simulated)'
+
+    def __init__(self, applicants: Sequence[FakeApplicant], failure_rate: float = 0.0, overlay_rate: float = 0.0, seed: Optional[int] = None):
+        self.applicants = applicants
+        self.failure_rate = failure_rate
+        self.overlay_rate = overlay_rate
+        self.random = random.Random(seed)
+        self.windows: Dict[str, Page] = {}
+        self.current_handle = ''
+        self.main_page: Optional[ApplicationPage] = None
+        self.cookies = [{'name': FakeEVision.COOKIE, 'value': uuid.uuid4().hex}]
+        self.calls: Counter = Counter()
+        self.calls_by_applicant: Dict[str, Counter] = {}
+
+    def _count(self, command: str) -> None:
+        self.calls[command] += 1
+        if self.main_page is not None:
+            student_number = self.applicants[self.main_page.i].student_number
+            self.calls_by_applicant.setdefault(student_number, Counter())[command] += 1
+
+    # Window management
+
+    def _load(self, handle: str, page: Page) -> None:
+        page.handle = handle
+        self.windows[handle] = page
+        if isinstance(page, ApplicationPage):
+            self.main_page = page
+
+    def _open(self, page: Page) -> None:
+        self._load(uuid.uuid4().hex, page)
+
+    def _close(self, handle: str) -> None:
+        del self.windows[handle]
+
+    @property
+    def page(self) -> Page:
+        try:
+            return self.windows[self.current_handle]
+        except KeyError:
+            raise NoSuchWindowException("Browsing context has been discarded")
+
+    # WebDriver API
+
+    def get(self, url: str) -> None:
+        self._count('get')
+        if not self.current_handle:
+            self.current_handle = uuid.uuid4().hex
+        self._load(self.current_handle, ApplicationPage(self, 0))
+
+    @property
+    def title(self) -> str:
+        self._count('getTitle')
+        return self.page.title
+
+    @property
+    def current_url(self) -> str:
+        self._count('getCurrentUrl')
+        return 'https://evision.invalid/{}/{}'.format(type(self.page).__name__, self.page.i)
+
+    @property
+    def page_source(self) -> str:
+        self._count('getPageSource')
+        return '<html><head><title>{}</title></head><body>{}</body></html>'.format(
+            self.page.title, ''.join(element._text for element in self.page.elements())
+        )
+
+    def get_screenshot_as_png(self) -> bytes:
+        self._count('takeScreenshot')
+        self.page
+        return self.BLANK_PNG
+
+    @property
+    def window_handles(self) -> List[str]:
+        self._count('getWindowHandles')
+        return list(self.windows)
+
+    @property
+    def current_window_handle(self) -> str:
+        self._count('getCurrentWindowHandle')
+        if self.current_handle not in self.windows:
+            raise NoSuchWindowException("Browsing context has been discarded")
+        return self.current_handle
+
+    @property
+    def switch_to(self) -> 'SimulatedWebDriver':
+        return self
+
+    def window(self, handle: str) -> None:
+        self._count('switchToWindow')
+        if handle not in self.windows:
+            raise NoSuchWindowException(handle)
+        self.current_handle = handle
+
+    def find_elements(self, by: str = By.ID, value: Optional[str] = None) -> List[SimulatedElement]:
+        self._count('findElements')
+        return self._find(by, value)
+
+    def find_element(self, by: str = By.ID, value: Optional[str] = None) -> SimulatedElement:
+        self._count('findElement')
+        if elements := self._find(by, value):
+            return elements[0]
+        raise NoSuchElementException("Unable to locate element: {}".format(value))
+
+    def _find(self, by: str, value: Optional[str]) -> List[SimulatedElement]:
+        page = self.page
+        elements = [e for e in page.elements() if (by, value) in e.locators]
+        if page.overlay is not None and (by, value) in page.overlay.locators:
+            elements.append(page.overlay)
+        return elements
+
+    def get_cookies(self) -> List[Dict[str, Any]]:
+        self._count('getAllCookies')
+        return list(self.cookies)
+
+    def execute_script(self, script: str, *args: Any) -> Any:
+        self._count('executeScript')
+        if script == SNAPSHOT_SCRIPT:
+            return self._snapshot()
+        elif script == RequestPDFScreen.SELECT_DOCS_SCRIPT:
+            page = self.page
+            if not isinstance(page, DocListPage):
+                return []
+            return page.select_docs(*args)
+        elif script.strip() == 'return navigator.userAgent':
+            return self.USER_AGENT
+        elif script.startswith(self.SYNC_PREFIX):
+            return self._evaluate(script[len(self.SYNC_PREFIX):], args)
+        raise WebDriverException("Simulated WebDriver cannot run script: {}".format(script.strip()[:200]))
+
+    def execute_async_script(self, script: str, args: Sequence[Any], timeout_ms: int) -> Any:
+        self._count('executeAsyncScript')
+        if not (script.startswith(self.ASYNC_PREFIX) and script.endswith(self.ASYNC_SUFFIX)):
+            raise WebDriverException("Simulated WebDriver cannot run script: {}".format(script.strip()[:200]))
+        result = self._evaluate(script[len(self.ASYNC_PREFIX):-len(self.ASYNC_SUFFIX)], args)
+        if not result:
+            # Nothing changes in the simulated page by itself, so the
+            # MutationObserver would wait until it times out
+            time.sleep(timeout_ms / 1000)
+            return None
+        return result
+
+    def close(self) -> None:
+        self._count('closeWindow')
+        self.page
+        self._close(self.current_handle)
+
+    def quit(self) -> None:
+        self._count('quit')
+        self.windows.clear()
+
+    # js_condition scripts
+
+    SYNC_PREFIX = EVEC.JS_PRELUDE + 'var args = arguments;\n'
+    ASYNC_PREFIX, ASYNC_SUFFIX = EVEC.js_condition('\0').async_script().split('\0')
+
+    def _evaluate(self, body: str, args: Sequence[Any]) -> Any:
+        page = self.page
+        stripped = body.strip()
+        if body == ApplicationDetailsScreen.EXTRACT_CONDITION.body:
+            if not isinstance(page, ApplicationPage):
+                return None
+            return {
+                'student_number': page.applicant.student_number,
+                'fields': dict(personal_details(page.applicant)),
+            }
+        elif stripped == 'return xpath(args[0]);':
+            return next(iter(self._find(By.XPATH, args[0])), None)
+        elif stripped == 'return !isVisible(xpath(args[0]));':
+            return not self._find(By.XPATH, args[0])
+        elif stripped == 'return !document.contains(args[0]);':
+            element = args[0]
+            if element is page.overlay:
+                # The overlay disappears as soon as the robot waits for it
+                page.overlay = None
+            return not element.attached
+        elif body == RequestPDFTroubleshootingScreen.BACK_DESTINATION.body:
+            if isinstance(page, DocListPage):
+                return "doc list"
+            return "back" if self._find(By.XPATH, args[2]) else None
+        elif 'sv-form-control' in body:
+            # RequestPDFScreen.wait_for_dom()
+            return isinstance(page, DocListPage)
+        elif 'click here' in body:
+            # RequestPDFScreen.extract_pdf()
+            return isinstance(page, ResultPage)
+        raise WebDriverException("Simulated WebDriver cannot evaluate condition: {}".format(stripped[:200]))
+
+    def _snapshot(self) -> Dict[str, Any]:
+        page = self.page
+        overlay = None
+        if page.overlay is not None:
+            overlay = {'titleElement': page.overlay, 'title': page.overlay._text, 'content': "Please wait", 'buttons': []}
+        return {
+            'docs': page.docs() if isinstance(page, DocListPage) else [],
+            'tabs': [
+                {'title': title, 'selected': n == page.tab}
+                for n, title in enumerate(TABS)
+            ] if isinstance(page, ApplicationPage) else [],
+            'overlay': overlay,
+        }
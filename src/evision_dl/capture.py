@@ -0,0 +1,203 @@
+# Copyright 2003 Dara Poon and the University of British Columbia
+#
+# This file is part of evision-dl.
+#
+# evision-dl is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# evision-dl is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# evision-dl. If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Per-applicant capture of DEBUG logs, and of the browser's state at the moment
+of failure, kept only for the applicants that need investigating.
+"""
+
+import gzip
+import logging
+from logging import Formatter, Handler, LogRecord
+import os
+from threading import get_ident
+from typing import Any, Callable, Dict, Optional, Set, Tuple
+
+from .applicant import Applicant, ApplicantContextChangeEvent
+from .download import (
+    PDFDownloadFailureEvent,
+    PDFDownloadSuccessEvent,
+    PDFGenerationCaveatEvent,
+    PDFGenerationFailureEvent,
+    PDFGenerationSuccessEvent,
+)
+from .event import Event, EventListener
+from .logging import AsyncLogPipeline
+from .robot import Robot, RobotFinishingEvent
+
+logger = logging.getLogger(__name__)
+
+######################################################################
+
+class _CaptureHandler(Handler):
+    """
+    Writes each record to the capture file of the thread that logged it.
+    Files are only opened and closed through the log pipeline, so that they
+    are ordered with respect to the records.
+    """
+
+    def __init__(self):
+        super().__init__(logging.DEBUG)
+        self.files: Dict[int, Any] = {}
+
+    def emit(self, record: LogRecord) -> None:
+        if (file := self.files.get(record.thread or 0)) is None:
+            return
+        try:
+            file.write(self.format(record) + '\n')
+        except Exception:
+            self.handleError(record)
+
+class DebugCapture(EventListener):
+    """
+    Streams each applicant's DEBUG records to a gzip-compressed file in the
+    directory, named after the student number, as they are logged.  The file
+    is kept if the applicant ends in a PDFFailureEvent or a caveat, along with
+    the page source and a screenshot taken when the failure was reported, and
+    deleted otherwise.
+    """
+
+    event_types = (
+        ApplicantContextChangeEvent,
+        PDFGenerationCaveatEvent,
+        PDFGenerationFailureEvent,
+        PDFGenerationSuccessEvent,
+        PDFDownloadFailureEvent,
+        PDFDownloadSuccessEvent,
+        RobotFinishingEvent,
+    )
+
+    FORMAT = "{asctime} [{levelname}] {threadName} @{name} {message}"
+
+    def __init__(self, directory: str, log_pipeline: Optional[AsyncLogPipeline] = None):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.log_pipeline = log_pipeline
+        self.handler = _CaptureHandler()
+        self.handler.setFormatter(Formatter(self.FORMAT, style='{'))
+        if log_pipeline:
+            log_pipeline.add_handler(self.handler)
+        else:
+            logging.getLogger().addHandler(self.handler)
+        # The applicant being processed by each robot, and its thread
+        self.current_applicants: Dict[Robot, Tuple[int, Applicant]] = {}
+        # Student numbers whose captures are to be kept
+        self.keep: Set[str] = set()
+        # Student numbers whose captures await the outcome of the download
+        self.awaiting_download: Set[str] = set()
+        self.snapshot_counts: Dict[str, int] = {}
+
+    def handle_event(self, robot: Robot, event: Event) -> None:
+        if isinstance(event, ApplicantContextChangeEvent):
+            self._end_capture(robot)
+            if event.applicant is not None:
+                thread = get_ident()
+                self.current_applicants[robot] = (thread, event.applicant)
+                self._in_log_order(lambda: self._open(thread, event.applicant.student_number))
+        elif isinstance(event, (PDFGenerationCaveatEvent, PDFGenerationFailureEvent)):
+            if current := self.current_applicants.get(robot):
+                self.keep.add(current[1].student_number)
+                self._snapshot(robot, current[1])
+        elif isinstance(event, PDFGenerationSuccessEvent):
+            if current := self.current_applicants.get(robot):
+                self.awaiting_download.add(current[1].student_number)
+        elif isinstance(event, PDFDownloadFailureEvent):
+            self.awaiting_download.discard(event.applicant.student_number)
+            self.keep.add(event.applicant.student_number)
+            # The download's own records were logged on a pool thread, which
+            # isn't captured, so record at least how it failed
+            record = logging.makeLogRecord({
+                'name': __name__,
+                'levelno': logging.ERROR,
+                'levelname': logging.getLevelName(logging.ERROR),
+                'msg': str(event),
+                'exc_info': (type(event.exception), event.exception, event.exception.__traceback__) if event.exception else None,
+            })
+            self._in_log_order(lambda: self._append(event.applicant.student_number, record))
+            logger.info("Kept debug capture {}".format(self._path(event.applicant.student_number, '.log.gz')))
+        elif isinstance(event, PDFDownloadSuccessEvent):
+            student_number = event.applicant.student_number
+            self.awaiting_download.discard(student_number)
+            if student_number not in self.keep:
+                self._in_log_order(lambda: self._delete(student_number))
+        elif isinstance(event, RobotFinishingEvent):
+            # Background downloads have been drained, so any applicant still
+            # current was interrupted
+            for r, (_, applicant) in list(self.current_applicants.items()):
+                if event.exception is not None:
+                    self.keep.add(applicant.student_number)
+                    self._snapshot(r, applicant)
+                self._end_capture(r)
+            if self.log_pipeline:
+                self.log_pipeline.remove_handler(self.handler)
+            else:
+                logging.getLogger().removeHandler(self.handler)
+
+    def _end_capture(self, robot: Robot) -> None:
+        if (current := self.current_applicants.pop(robot, None)) is None:
+            return
+        thread, applicant = current
+        student_number = applicant.student_number
+        if student_number in self.keep:
+            logger.info("Kept debug capture {}".format(self._path(student_number, '.log.gz')))
+            self._in_log_order(lambda: self._close(thread))
+        elif student_number in self.awaiting_download:
+            self._in_log_order(lambda: self._close(thread))
+        else:
+            self._in_log_order(lambda: (self._close(thread), self._delete(student_number)))
+
+    def _in_log_order(self, request: Callable[[], Any]) -> None:
+        if self.log_pipeline:
+            self.log_pipeline.call(request)
+        else:
+            request()
+
+    def _path(self, student_number: str, suffix: str) -> str:
+        return os.path.join(self.directory, student_number + suffix)
+
+    def _open(self, thread: int, student_number: str) -> None:
+        self._close(thread)
+        self.handler.files[thread] = gzip.open(self._path(student_number, '.log.gz'), 'wt', encoding='utf-8')
+
+    def _close(self, thread: int) -> None:
+        if (file := self.handler.files.pop(thread, None)) is not None:
+            file.close()
+
+    def _append(self, student_number: str, record: LogRecord) -> None:
+        # The applicant's capture file has been closed, as it awaited the
+        # download, so add to it as another gzip member
+        with gzip.open(self._path(student_number, '.log.gz'), 'at', encoding='utf-8') as f:
+            f.write(self.handler.format(record) + '\n')
+
+    def _delete(self, student_number: str) -> None:
+        try:
+            os.remove(self._path(student_number, '.log.gz'))
+        except FileNotFoundError:
+            pass
+
+    def _snapshot(self, robot: Robot, applicant: Applicant) -> None:
+        """
+        Save the page source and a screenshot of the robot's browser.
+        """
+        n = self.snapshot_counts[applicant.student_number] = self.snapshot_counts.get(applicant.student_number, 0) + 1
+        prefix = '{}-{}'.format(applicant.student_number, n)
+        try:
+            with gzip.open(self._path(prefix, '.html.gz'), 'wt', encoding='utf-8') as f:
+                f.write(robot.driver.page_source)
+            with open(self._path(prefix, '.png'), 'wb') as f:
+                f.write(robot.driver.get_screenshot_as_png())
+        except Exception as e:
+            logger.warning("Could not capture the browser's state for {}: {}".format(applicant.student_number, e))
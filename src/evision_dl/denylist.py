@@ -0,0 +1,93 @@
+# Copyright 2003 Dara Poon and the University of British Columbia
+#
+# This file is part of evision-dl.
+#
+# evision-dl is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# evision-dl is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# evision-dl. If not, see <https://www.gnu.org/licenses/>.
+
+import json
+import logging
+import os
+import re
+from typing import Dict, Iterator
+
+from .download import PDFGenerationCaveatEvent
+from .event import Event, EventListener
+from .robot import Robot
+
+logger = logging.getLogger(__name__)
+
+######################################################################
+
+class DocumentDenyList(EventListener):
+    """
+    Learns which types of documents cause PDF merges to fail, from the
+    results of troubleshooting, and remembers them in a JSON file.  Iterating
+    over the deny list yields the document types that have failed often
+    enough that they should be deselected up front.
+    """
+
+    event_types = (PDFGenerationCaveatEvent,)
+
+    def __init__(self, path: str, min_failures: int = 3, min_failure_rate: float = 0.5):
+        self.path = path
+        self.min_failures = min_failures
+        self.min_failure_rate = min_failure_rate
+        # For each document type, how many times it was tested during
+        # troubleshooting, and how many times it turned out to be problematic
+        self.counts: Dict[str, Dict[str, int]] = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                self.counts = json.load(f)
+        logger.debug("Learned unwanted document types: {}".format(list(self)))
+
+    def __iter__(self) -> Iterator[str]:
+        for doc_type, count in self.counts.items():
+            failures, tested = count.get('failures', 0), count.get('tested', 0)
+            if failures >= self.min_failures and failures >= self.min_failure_rate * tested:
+                yield doc_type
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def __contains__(self, doc_type: object) -> bool:
+        return any(doc_type == t for t in self)
+
+    def handle_event(self, robot: Robot, event: Event) -> None:
+        if isinstance(event, PDFGenerationCaveatEvent):
+            for doc in event.documents:
+                self._count(self.doc_type(doc), 'tested')
+            for doc in event.problems:
+                doc_type = self.doc_type(doc)
+                already_denied = doc_type in self
+                self._count(doc_type, 'failures')
+                if not already_denied and doc_type in self:
+                    logger.info("Documents of type \"{}\" will be excluded from PDFs from now on".format(doc_type))
+            self.save()
+
+    def save(self) -> None:
+        tmp_path = self.path + os.path.extsep + 'part'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.counts, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.path)
+
+    def _count(self, doc_type: str, key: str) -> None:
+        # An empty type would match every document
+        if not doc_type:
+            return
+        count = self.counts.setdefault(doc_type, {})
+        count[key] = count.get(key, 0) + 1
+
+    @staticmethod
+    def doc_type(doc: str) -> str:
+        # "Reference Letter (john doe.pdf, 21/Dec/2022)" -> "Reference Letter"
+        return re.sub(r'\s+', ' ', re.sub(r'\s*\([^()]*\)\s*$', '', doc)).strip()
@@ -14,15 +14,25 @@
 # You should have received a copy of the GNU General Public License along with
 # evision-dl. If not, see <https://www.gnu.org/licenses/>.
 
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from http.client import HTTPException
 import logging
 import os
-from typing import List, Optional, Tuple
-from urllib.request import build_opener
-from urllib.parse import urlparse
+import re
+import tempfile
+from threading import BoundedSemaphore
+import time
+from typing import Dict, Iterator, List, Optional, Tuple
+from urllib.error import HTTPError
 
 from .applicant import Applicant, ApplicantContextChangeEvent
+from .backoff import CircuitBreaker, RetryPolicy
 from .event import Event, EventListener
-from .robot import Robot
+from .metrics import metrics
+from .pdf import InvalidPDFError, PDFValidator
+from .robot import Robot, RobotDrainingEvent
+from .session import HTTPSession
 
 ######################################################################
 
@@ -39,8 +49,10 @@ class PDFGenerationEvent(Event):
     pass
 
 class PDFGenerationCaveatEvent(PDFGenerationEvent):
-    def __init__(self, problems:List[str]):
+    def __init__(self, problems:List[str], documents:Optional[List[str]] = None):
         self.problems = problems
+        # All of the documents that were tested, problematic or not
+        self.documents = documents if documents is not None else problems
 
     def __str__(self):
         return "problematic PDF documents: {}".format(self.problems)
@@ -52,6 +64,15 @@ class PDFGenerationFailureEvent(PDFGenerationEvent, PDFFailureEvent):
     def __str__(self) -> str:
         return "no PDF: {}" + (": " + self.message if self.message else '')
 
+class PDFGenerationTimeoutEvent(PDFGenerationFailureEvent):
+    """
+    PDF generation seemed to hang, so the applicant was abandoned, to be
+    retried by a later run with --resume.
+    """
+    def __init__(self, timeout:float):
+        super().__init__("Abandoned after waiting {:g} s for the PDF to be generated".format(timeout))
+        self.timeout = timeout
+
 class PDFGenerationSuccessEvent(PDFGenerationEvent):
     def __init__(self, url:str, http_headers:List[Tuple[str, str]]):
         self.url = url
@@ -75,48 +96,117 @@ class PDFDownloadFailureEvent(PDFDownloadEvent, PDFFailureEvent):
         return "Failed to download PDF for {}: {}".format(self.applicant, self.exception)
 
 class PDFDownloadSuccessEvent(PDFDownloadEvent):
-    def __init__(self, applicant: Applicant, dest_path: str):
+    def __init__(self, applicant: Applicant, dest_path: str, size: int = 0, duration: float = 0.0, page_count: Optional[int] = None):
         super().__init__(applicant)
         self.dest_path = dest_path
+        self.size = size
+        self.duration = duration
+        # None if the pages could not be counted
+        self.page_count = page_count
+
+    @property
+    def bytes_per_sec(self) -> float:
+        return self.size / self.duration if self.duration > 0 else 0.0
 
     def __str__(self) -> str:
-        return "Downloaded PDF for {} to {}".format(self.applicant, self.dest_path)
+        return "Downloaded PDF for {} to {} ({} pages, {} bytes, {:.0f} bytes/s)".format(
+            self.applicant, self.dest_path, self.page_count or "?", self.size, self.bytes_per_sec
+        )
 
 ######################################################################
 
 logger = logging.getLogger(__name__)
 
 class Downloader(EventListener):
-    def __init__(self, dest_dir: str):
+    event_types = (
+        ApplicantContextChangeEvent,
+        PDFGenerationFailureEvent,
+        PDFGenerationSuccessEvent,
+        RobotDrainingEvent,
+    )
+
+    CHUNK_SIZE = 1 << 16
+
+    def __init__(self, dest_dir: str, fsync: bool = False, chunk_size: int = CHUNK_SIZE, workers: int = 2, queue_size: int = 4, session: Optional[HTTPSession] = None):
         self.dest_dir = dest_dir
-        self.current_applicant:Optional[Applicant] = None
+        self.fsync = fsync
+        self.chunk_size = chunk_size
+        # Reuse connections to eVision across downloads
+        self.session = session or HTTPSession(max_connections_per_host=workers)
+        # The applicant being processed by each robot
+        self.current_applicants:Dict[Robot, Optional[Applicant]] = {}
+        # Downloads run in the background, so that the robot can proceed to
+        # the next applicant while the HTTP transfer finishes.  The semaphore
+        # limits the number of downloads that are running or waiting, so that
+        # the robot blocks if it gets too far ahead.
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='download')
+        self.slots = BoundedSemaphore(workers + queue_size)
 
     def handle_event(self, robot:Robot, event:Event) -> None:
         if isinstance(event, ApplicantContextChangeEvent):
-            self.current_applicant = event.applicant
+            self.current_applicants[robot] = event.applicant
         elif isinstance(event, PDFGenerationFailureEvent):
-            self._handle_unavailable_pdf(event.message)
+            applicant = self.current_applicants.get(robot)
+            assert applicant is not None
+            self._handle_unavailable_pdf(applicant, event.message)
             robot.post_event(ApplicantContextChangeEvent(None))
         elif isinstance(event, PDFGenerationSuccessEvent):
-            assert self.current_applicant is not None
-            try:
-                dest_path = self._handle_available_pdf(event.url, event.http_headers)
-                robot.post_event(PDFDownloadSuccessEvent(self.current_applicant, dest_path))
-            except Exception as e:
-                logger.error(e)
-                robot.post_event(PDFDownloadFailureEvent(self.current_applicant, e))
-        elif isinstance(event, PDFDownloadEvent):
+            applicant = self.current_applicants.get(robot)
+            assert applicant is not None
+            if not self.slots.acquire(blocking=False):
+                logger.info("Waiting for a download slot to become available")
+                self.slots.acquire()
+            self.executor.submit(self._download, robot, applicant, event)
             robot.post_event(ApplicantContextChangeEvent(None))
+        elif isinstance(event, RobotDrainingEvent):
+            self.drain(robot)
+
+    def drain(self, robot:Robot) -> None:
+        """
+        Wait for all background downloads to finish, and dispatch their
+        results.
+        """
+        self.executor.shutdown(wait=True)
+        self.session.close()
+        robot.dispatch_pending_events()
 
-    def _handle_unavailable_pdf(self, error_msg: str) -> str:
-        logger.error("No PDF generated for {}".format(self.current_applicant))
-        dest_path = self._pdf_dest_path_for_applicant()
+    def _download(self, robot:Robot, applicant:Applicant, event:PDFGenerationSuccessEvent) -> None:
+        # Runs on a worker thread, so results must be handed back to the robot
+        # to be dispatched on its own thread.
+        try:
+            start_time = time.monotonic()
+            dest_path, size, page_count = self._handle_available_pdf(applicant, event.url, event.http_headers)
+            duration = time.monotonic() - start_time
+            robot.post_event_threadsafe(PDFDownloadSuccessEvent(applicant, dest_path, size, duration, page_count))
+        except Exception as e:
+            logger.error(e)
+            robot.post_event_threadsafe(PDFDownloadFailureEvent(applicant, e))
+        finally:
+            self.slots.release()
+
+    def _handle_unavailable_pdf(self, applicant: Applicant, error_msg: str) -> str:
+        logger.error("No PDF generated for {}".format(applicant))
+        dest_path = self._pdf_dest_path_for_applicant(applicant)
         with open(dest_path, 'wb') as f:
             # Just make an empty file as evidence of the failure
             pass
         return dest_path
 
-    def _handle_available_pdf(self, url: str, http_headers: List[Tuple[str, str]]) -> str:
+    # Transfers that fail, or that don't yield a complete PDF, are retried a
+    # few times, as are server errors.  Downloads have their own circuit
+    # breaker, so that their failures don't pause the robots' clicks, nor
+    # theirs the downloads.
+    DOWNLOAD_RETRY = RetryPolicy(
+        'download',
+        (InvalidPDFError, HTTPError, HTTPException, ConnectionError, TimeoutError),
+        tries=3,
+        initial_delay=2,
+        max_delay=30,
+        breaker=CircuitBreaker(),
+        retryable=lambda e: not isinstance(e, HTTPError) or e.code >= 500,
+    )
+
+    def _handle_available_pdf(self, applicant: Applicant, url: str, http_headers: List[Tuple[str, str]]) -> Tuple[str, int, Optional[int]]:
         # Downloading files using the webdriver is complicated.  We don't know
         # whether the browser will display the PDF, launch a helper application
         # to view it, use a plugin, or save it.  If saving, it's hard to
@@ -124,19 +214,61 @@ class Downloader(EventListener):
         #
         # It's easier to download it using Python instead.
         logger.debug("PDF URL {}".format(url))
-        dest_path = self._pdf_dest_path_for_applicant()
-        opener = build_opener()
-        opener.addheaders = http_headers
-        with opener.open(url) as res, open(dest_path, 'wb') as f:
-            f.write(res.read())
+        dest_path = self._pdf_dest_path_for_applicant(applicant)
+        validator = self.DOWNLOAD_RETRY.call(self._fetch_pdf, url, http_headers, dest_path)
+        if validator.encrypted:
+            logger.warning("PDF for {} is encrypted".format(applicant))
         logger.info("Downloaded PDF to {}".format(dest_path))
-        return dest_path
+        return dest_path, validator.size, validator.page_count
+
+    def _fetch_pdf(self, url: str, http_headers: List[Tuple[str, str]], dest_path: str) -> PDFValidator:
+        with ExitStack() as stack:
+            with metrics.timer('download_seconds', phase='request'):
+                res = stack.enter_context(self.session.open(url, http_headers))
+            content_length = res.getheader('Content-Length')
+            validator = PDFValidator(
+                res.getheader('Content-Type'),
+                int(content_length) if content_length and content_length.isdigit() else None,
+            )
+            with metrics.timer('download_seconds', phase='transfer'):
+                self._stream_to_file(res, dest_path, validator)
+        return validator
+
+    def _stream_to_file(self, res, dest_path: str, validator: Optional[PDFValidator] = None) -> int:
+        # Merged PDFs can be hundreds of megabytes, so copy them in chunks
+        # rather than holding the whole thing in memory.  Write to a temporary
+        # file in the same directory, then rename it into place, so that a
+        # crash never leaves a truncated file under the final name.  The
+        # validator, if any, checks each chunk before it is written, and the
+        # whole file before it is renamed.
+        fd, tmp_path = tempfile.mkstemp(
+            dir=os.path.dirname(dest_path) or os.path.curdir,
+            prefix=os.path.curdir,
+            suffix=os.path.extsep + 'part',
+        )
+        size = 0
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                while chunk := res.read(self.chunk_size):
+                    if validator:
+                        validator.feed(chunk)
+                    f.write(chunk)
+                    size += len(chunk)
+                if validator:
+                    validator.close()
+                if self.fsync:
+                    f.flush()
+                    os.fsync(f.fileno())
+            os.replace(tmp_path, dest_path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        return size
 
-    def _pdf_dest_path_for_applicant(self) -> str:
-        assert self.current_applicant is not None
-        surname = self.current_applicant.surname
-        preferred_name = self.current_applicant.preferred_name
-        student_number = self.current_applicant.student_number
+    def _pdf_dest_path_for_applicant(self, applicant: Applicant) -> str:
+        surname = applicant.surname
+        preferred_name = applicant.preferred_name
+        student_number = applicant.student_number
         # Fill in filename template, guarding against directory traversal attacks
         filename = '{sn}, {prefname} ({nnnnnnnn}){EXT}pdf'.format(
             sn=' ' + surname if surname.startswith(os.path.curdir) else surname,
@@ -145,3 +277,34 @@ class Downloader(EventListener):
             EXT=os.path.extsep,
         ).replace(os.path.sep, ' ')
         return os.path.join(self.dest_dir, filename)
+
+######################################################################
+
+class DownloadIndex:
+    """
+    Index of the PDFs already in the destination directory, by student
+    number, based on the filenames produced by Downloader.  Empty files,
+    which the Downloader leaves as evidence of failures, are not counted as
+    done, so that those applicants are retried.
+    """
+
+    FILENAME_RE = re.compile(r'\((\d{8})\)' + re.escape(os.path.extsep) + r'pdf$')
+
+    def __init__(self, dest_dir: str):
+        self.dest_dir = dest_dir
+        self.paths: Dict[str, str] = {}
+        with os.scandir(dest_dir) as entries:
+            for entry in entries:
+                match = self.FILENAME_RE.search(entry.name)
+                if match and entry.is_file() and entry.stat().st_size > 0:
+                    self.paths[match.group(1)] = entry.path
+        logger.info("Found {} PDFs already downloaded in {}".format(len(self.paths), dest_dir))
+
+    def __contains__(self, student_number: object) -> bool:
+        return student_number in self.paths
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.paths)
+
+    def __len__(self) -> int:
+        return len(self.paths)
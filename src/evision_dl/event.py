@@ -14,10 +14,16 @@
 # You should have received a copy of the GNU General Public License along with
 # evision-dl. If not, see <https://www.gnu.org/licenses/>.
 
-from typing import Any, TYPE_CHECKING
+from collections import deque
+import logging
+from queue import SimpleQueue
+from threading import Thread
+from typing import Deque, Dict, Iterable, List, Optional, Tuple, Type, TYPE_CHECKING
 if TYPE_CHECKING:
     from .robot import Robot
 
+logger = logging.getLogger(__name__)
+
 ######################################################################
 
 # Abstract class
@@ -28,5 +34,109 @@ class Event:
 
 # Abstract class
 class EventListener:
+    # The types of events that the listener wants to receive, including
+    # their subclasses
+    event_types: Tuple[Type[Event], ...] = (Event,)
+
     def handle_event(self, robot: 'Robot', event: Event) -> None:
         raise NotImplementedError
+
+######################################################################
+
+class AsyncEventListener(EventListener):
+    """
+    Wraps a listener so that it handles events, in the order posted, on its
+    own thread, and never holds up the robot.
+    """
+    def __init__(self, listener: EventListener):
+        self.listener = listener
+        self.event_types = listener.event_types
+        self.queue: SimpleQueue = SimpleQueue()
+        self.thread = Thread(target=self._run, name=type(listener).__name__, daemon=True)
+        self.thread.start()
+
+    def handle_event(self, robot: 'Robot', event: Event) -> None:
+        self.queue.put((robot, event))
+
+    def close(self) -> None:
+        """
+        Wait for all queued events to be handled.
+        """
+        self.queue.put(None)
+        self.thread.join()
+
+    def _run(self) -> None:
+        while (item := self.queue.get()) is not None:
+            robot, event = item
+            try:
+                self.listener.handle_event(robot, event)
+            except Exception as e:
+                logger.error("{} failed to handle {}".format(type(self.listener).__name__, type(event).__name__), exc_info=e)
+
+######################################################################
+
+class EventBus:
+    """
+    Dispatches each event to the listeners subscribed to its type, in the
+    order in which they subscribed.
+
+    An event posted by a listener while another event is being dispatched is
+    queued, and dispatched once the earlier event has reached every listener,
+    so that all listeners see the events in the same order.  Callers must not
+    dispatch concurrently; robots hold their event_lock.
+
+    If a listener raises an exception, the remaining listeners still receive
+    the event, and the queued events are still dispatched.  The first
+    exception is then re-raised; any others are logged.
+    """
+    def __init__(self):
+        self.subscriptions: List[Tuple[EventListener, Tuple[Type[Event], ...]]] = []
+        self.async_listeners: List[AsyncEventListener] = []
+        self._dispatch_table: Dict[Type[Event], List[EventListener]] = {}
+        self._queue: Deque[Tuple['Robot', Event]] = deque()
+        self._dispatching = False
+
+    def subscribe(self, listener: EventListener, event_types: Optional[Iterable[Type[Event]]] = None, asynchronous: bool = False) -> None:
+        if any(l is listener or getattr(l, 'listener', None) is listener for l, _ in self.subscriptions):
+            return
+        if asynchronous:
+            listener = AsyncEventListener(listener)
+            self.async_listeners.append(listener)
+        self.subscriptions.append((listener, tuple(event_types or listener.event_types)))
+        self._dispatch_table.clear()
+
+    def listeners_for(self, event_type: Type[Event]) -> List[EventListener]:
+        listeners = self._dispatch_table.get(event_type)
+        if listeners is None:
+            listeners = self._dispatch_table[event_type] = [
+                listener for listener, event_types in self.subscriptions
+                if issubclass(event_type, event_types)
+            ]
+        return listeners
+
+    def dispatch(self, robot: 'Robot', event: Event) -> None:
+        self._queue.append((robot, event))
+        if self._dispatching:
+            return
+        self._dispatching = True
+        error: Optional[Exception] = None
+        try:
+            while self._queue:
+                robot, event = self._queue.popleft()
+                for listener in self.listeners_for(type(event)):
+                    try:
+                        listener.handle_event(robot, event)
+                    except Exception as e:
+                        if error is None:
+                            error = e
+                        else:
+                            logger.error("{} failed to handle {}".format(type(listener).__name__, type(event).__name__), exc_info=e)
+        finally:
+            self._queue.clear()
+            self._dispatching = False
+        if error is not None:
+            raise error
+
+    def close(self) -> None:
+        for listener in self.async_listeners:
+            listener.close()
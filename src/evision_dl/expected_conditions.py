@@ -63,3 +63,71 @@ class window_closed(object):
         current_windows = driver.window_handles
         if len(current_windows) < len(self.orig_windows):
             return Window(current_windows.pop())
+
+# Helpers available to the body of every js_condition
+JS_PRELUDE = '''
+var xpath = function (expr, context) {
+    return document.evaluate(expr, context || document, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue;
+};
+var isVisible = function (el) {
+    return !!el && el.getClientRects().length > 0 && window.getComputedStyle(el).visibility !== 'hidden';
+};
+'''
+
+class js_condition(object):
+    """
+    An expected condition that is evaluated entirely within the page, in one
+    WebDriver round trip.  The body is the text of a JavaScript function that
+    returns a truthy value when the condition is met; it may refer to its
+    arguments as args[0], args[1], ..., and use the helpers xpath(expr) and
+    isVisible(element).
+
+    It may be used with WebDriverWait(...).until(...), but Screen.wait(...)
+    can instead wait for it using a MutationObserver, without polling.
+    """
+    def __init__(self, body: str, *args: Any):
+        self.body = body
+        self.args = args
+
+    def __call__(self, driver: WebDriver) -> Any:
+        return driver.execute_script(
+            JS_PRELUDE + 'var args = arguments;\n' + self.body,
+            *self.args
+        ) or False
+
+    def async_script(self) -> str:
+        """
+        Script for execute_async_script(script, args, timeout_ms), which
+        calls back with the condition's value as soon as it becomes truthy,
+        re-evaluating it whenever the DOM changes, or with null on timeout.
+        """
+        return JS_PRELUDE + '''
+            var args = arguments[0];
+            var done = arguments[arguments.length - 1];
+            var test = function () {
+                try {
+        ''' + self.body + '''
+                } catch (e) {
+                    return null;
+                }
+            };
+            var result = test();
+            if (result) {
+                done(result);
+                return;
+            }
+            var timer;
+            var observer = new MutationObserver(function () {
+                var result = test();
+                if (result) {
+                    observer.disconnect();
+                    clearTimeout(timer);
+                    done(result);
+                }
+            });
+            observer.observe(document, {childList: true, subtree: true, attributes: true, characterData: true});
+            timer = setTimeout(function () {
+                observer.disconnect();
+                done(null);
+            }, arguments[1]);
+        '''
@@ -0,0 +1,184 @@
+# Copyright 2003 Dara Poon and the University of British Columbia
+#
+# This file is part of evision-dl.
+#
+# evision-dl is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# evision-dl is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# evision-dl. If not, see <https://www.gnu.org/licenses/>.
+
+import json
+import logging
+import sqlite3
+from threading import RLock
+import time
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+from .applicant import Applicant, ApplicantContextChangeEvent, ApplicantSkippedEvent
+from .download import (
+    PDFDownloadEvent,
+    PDFGenerationEvent,
+    PDFGenerationCaveatEvent,
+    PDFGenerationFailureEvent,
+    PDFGenerationSuccessEvent,
+    PDFDownloadFailureEvent,
+    PDFDownloadSuccessEvent,
+)
+from .event import Event, EventListener
+from .robot import Robot, RobotFinishingEvent
+
+logger = logging.getLogger(__name__)
+
+######################################################################
+
+class Journal(EventListener):
+    """
+    A record of the run, kept in an SQLite database so that it survives a
+    crash.  Every event is appended to the events table, and the latest
+    outcome for each applicant is kept in the applicants table, so that a
+    later run can tell which applicants remain without reading the whole
+    history.  The transaction is committed, and therefore synced to disk,
+    whenever an applicant's work is finished.
+
+    Committing is slow, so the journal may be subscribed asynchronously.
+    """
+
+    event_types = (
+        ApplicantContextChangeEvent,
+        ApplicantSkippedEvent,
+        PDFGenerationEvent,
+        PDFDownloadEvent,
+        RobotFinishingEvent,
+    )
+
+    SCHEMA = '''
+        CREATE TABLE IF NOT EXISTS events (
+            id INTEGER PRIMARY KEY,
+            time REAL NOT NULL,
+            student_number TEXT,
+            kind TEXT NOT NULL,
+            duration REAL,
+            detail TEXT
+        );
+        CREATE INDEX IF NOT EXISTS events_student_number ON events (student_number);
+        CREATE TABLE IF NOT EXISTS applicants (
+            student_number TEXT PRIMARY KEY,
+            surname TEXT,
+            preferred_name TEXT,
+            outcome TEXT NOT NULL,
+            dest_path TEXT,
+            updated REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS applicants_outcome ON applicants (outcome);
+    '''
+
+    # Outcomes recorded in the applicants table
+    STARTED = 'started'
+    SKIPPED = 'skipped'
+    GENERATION_FAILED = 'generation failed'
+    DOWNLOAD_FAILED = 'download failed'
+    DOWNLOADED = 'downloaded'
+
+    def __init__(self, path: str):
+        self.path = path
+        # Events may be handled on another thread from lookups, so access to
+        # the database must be serialized
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.lock = RLock()
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=FULL')
+        self.db.executescript(self.SCHEMA)
+        # The applicant being processed by each robot, and when it started
+        self.current_applicants: Dict[Robot, Tuple[Applicant, float]] = {}
+
+    def handle_event(self, robot: Robot, event: Event) -> None:
+        with self.lock:
+            self._handle_event(robot, event)
+
+    def _handle_event(self, robot: Robot, event: Event) -> None:
+        current_applicant: Optional[Applicant] = None
+        elapsed: Optional[float] = None
+        if current := self.current_applicants.get(robot):
+            current_applicant, elapsed = current[0], time.monotonic() - current[1]
+        if isinstance(event, ApplicantContextChangeEvent):
+            if event.applicant is None:
+                self._record(current_applicant, 'context cleared')
+                self.db.commit()
+                self.current_applicants.pop(robot, None)
+            else:
+                self._record(event.applicant, 'context')
+                self._set_outcome(event.applicant, self.STARTED)
+                self.current_applicants[robot] = (event.applicant, time.monotonic())
+        elif isinstance(event, ApplicantSkippedEvent):
+            self._record(event.applicant, 'skipped')
+            self._set_outcome(event.applicant, self.SKIPPED, replace=False)
+        elif isinstance(event, PDFGenerationCaveatEvent):
+            assert current_applicant is not None
+            self._record(current_applicant, 'generation caveat', elapsed, {'problems': event.problems})
+        elif isinstance(event, PDFGenerationFailureEvent):
+            assert current_applicant is not None
+            self._record(current_applicant, 'generation failure', elapsed, {'message': event.message})
+            self._set_outcome(current_applicant, self.GENERATION_FAILED)
+        elif isinstance(event, PDFGenerationSuccessEvent):
+            assert current_applicant is not None
+            self._record(current_applicant, 'generation success', elapsed)
+        elif isinstance(event, PDFDownloadFailureEvent):
+            self._record(event.applicant, 'download failure', None, {'exception': str(event.exception)})
+            self._set_outcome(event.applicant, self.DOWNLOAD_FAILED)
+            self.db.commit()
+        elif isinstance(event, PDFDownloadSuccessEvent):
+            self._record(event.applicant, 'download success', event.duration, {'dest_path': event.dest_path, 'size': event.size, 'page_count': event.page_count})
+            self._set_outcome(event.applicant, self.DOWNLOADED, event.dest_path)
+            self.db.commit()
+        elif isinstance(event, RobotFinishingEvent):
+            self._record(None, 'finishing', None, {'exception': str(event.exception)} if event.exception else None)
+            self.close()
+
+    def close(self) -> None:
+        with self.lock:
+            self.db.commit()
+            self.db.close()
+
+    def __contains__(self, student_number: object) -> bool:
+        """
+        Whether the applicant's PDF was downloaded in a previous run.
+        """
+        with self.lock:
+            return self.db.execute(
+                'SELECT 1 FROM applicants WHERE student_number = ? AND outcome IN (?, ?)',
+                (student_number, self.DOWNLOADED, self.SKIPPED)
+            ).fetchone() is not None
+
+    def outcome_counts(self) -> Dict[str, int]:
+        with self.lock:
+            return dict(self.db.execute('SELECT outcome, COUNT(*) FROM applicants GROUP BY outcome'))
+
+    def applicants_with_outcome(self, outcome: str) -> Iterator[Tuple[Applicant, Optional[str]]]:
+        with self.lock:
+            rows = self.db.execute(
+                'SELECT student_number, surname, preferred_name, dest_path FROM applicants WHERE outcome = ? ORDER BY updated',
+                (outcome,)
+            ).fetchall()
+        for student_number, surname, preferred_name, dest_path in rows:
+            yield Applicant(student_number, surname, preferred_name), dest_path
+
+    def _record(self, applicant: Optional[Applicant], kind: str, duration: Optional[float] = None, detail: Optional[Dict[str, Any]] = None) -> None:
+        self.db.execute(
+            'INSERT INTO events (time, student_number, kind, duration, detail) VALUES (?, ?, ?, ?, ?)',
+            (time.time(), applicant.student_number if applicant else None, kind, duration, json.dumps(detail) if detail else None)
+        )
+
+    def _set_outcome(self, applicant: Optional[Applicant], outcome: str, dest_path: Optional[str] = None, replace: bool = True) -> None:
+        if applicant is None:
+            return
+        self.db.execute(
+            'INSERT OR ' + ('REPLACE' if replace else 'IGNORE') + ' INTO applicants (student_number, surname, preferred_name, outcome, dest_path, updated) VALUES (?, ?, ?, ?, ?, ?)',
+            (applicant.student_number, applicant.surname, applicant.preferred_name, outcome, dest_path, time.time())
+        )
@@ -14,6 +14,8 @@
 # You should have received a copy of the GNU General Public License along with
 # evision-dl. If not, see <https://www.gnu.org/licenses/>.
 
+from bisect import bisect_left
+from collections import deque
 from logging import (
     DEBUG,
     INFO,
@@ -21,9 +23,12 @@ from logging import (
     ERROR,
     CRITICAL,
     Formatter,
+    Handler,
     LogRecord,
 )
-from typing import Sequence, Tuple
+from logging.handlers import QueueHandler, QueueListener
+from queue import SimpleQueue
+from typing import Any, Callable, Deque, Dict, Sequence, Tuple
 
 import colorama
 
@@ -39,14 +44,115 @@ DEFAULT_FMT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s (%(filename)
 
 class ColorFormatter(Formatter):
     def __init__(self, fmt: str = DEFAULT_FMT, level_colors: Sequence[Tuple[int, str]] = DEFAULT_LEVEL_COLORS, **kwargs):
-        self._formats = [
-            (level, Formatter(color + fmt + colorama.Style.RESET_ALL, **kwargs))
-            for level, color in sorted(level_colors)
+        self._levels = [level for level, _ in sorted(level_colors)]
+        self._formatters = [
+            Formatter(color + fmt + colorama.Style.RESET_ALL, **kwargs)
+            for _, color in sorted(level_colors)
         ]
+        # The formatter for each level number seen so far
+        self._formatters_by_level: Dict[int, Formatter] = {}
 
     def format(self, record: LogRecord) -> str:
-        formatter = next(
-            formatter for levelno, formatter in self._formats
-            if levelno >= record.levelno
-        )
+        try:
+            formatter = self._formatters_by_level[record.levelno]
+        except KeyError:
+            # The formatter for the lowest level at or above the record's
+            i = min(bisect_left(self._levels, record.levelno), len(self._levels) - 1)
+            formatter = self._formatters_by_level[record.levelno] = self._formatters[i]
         return formatter.format(record)
+
+######################################################################
+
+class ReplayBuffer(Handler):
+    """
+    Keeps the most recent records, unformatted, until they are discarded or
+    replayed to the target handler.  The oldest records are dropped to keep
+    the buffer to about capacity bytes, estimated from the length of each
+    message.
+    """
+
+    # Approximate size of a LogRecord, excluding its message
+    RECORD_OVERHEAD = 512
+
+    def __init__(self, target: Handler, capacity: int = 4 << 20, level: int = DEBUG):
+        super().__init__(level)
+        self.target = target
+        self.capacity = capacity
+        self.records: Deque[Tuple[LogRecord, int]] = deque()
+        self.size = 0
+
+    def emit(self, record: LogRecord) -> None:
+        size = self.RECORD_OVERHEAD + (len(record.msg) if isinstance(record.msg, str) else 0)
+        self.records.append((record, size))
+        self.size += size
+        while self.size > self.capacity and len(self.records) > 1:
+            _, dropped_size = self.records.popleft()
+            self.size -= dropped_size
+
+    def discard(self) -> None:
+        self.records.clear()
+        self.size = 0
+
+    def replay(self) -> None:
+        # Handler.handle() doesn't check the level, so the target emits even
+        # the DEBUG records
+        for record, _ in self.records:
+            self.target.handle(record)
+        self.discard()
+
+class _LazyQueueHandler(QueueHandler):
+    def prepare(self, record: LogRecord) -> LogRecord:
+        # Unlike QueueHandler, leave the formatting to the listener's thread
+        return record
+
+class _LogListener(QueueListener):
+    def handle(self, record: Any) -> None:
+        if callable(record):
+            # A request to be performed in order with the records
+            record()
+        else:
+            super().handle(record)
+
+class AsyncLogPipeline:
+    """
+    Hands log records to a background thread, so that logging costs the
+    caller little more than creating the record.  On that thread, records are
+    formatted and emitted by the handler, subject to its level, and the
+    recent ones, down to DEBUG, are kept in a ReplayBuffer, to be replayed to
+    the handler if something goes wrong.
+
+    Install queue_handler as the root logger's only handler, and close() the
+    pipeline before exiting, to emit the records still in the queue.
+    """
+    def __init__(self, handler: Handler, replay_capacity: int = 4 << 20):
+        self.queue: SimpleQueue = SimpleQueue()
+        self.queue_handler = _LazyQueueHandler(self.queue)
+        self.replay_buffer = ReplayBuffer(handler, replay_capacity)
+        self.listener = _LogListener(self.queue, handler, self.replay_buffer, respect_handler_level=True)
+        self.listener.start()
+
+    def call(self, request: Callable[[], Any]) -> None:
+        """
+        Call the function on the background thread, after the records that
+        have already been logged have been handled.
+        """
+        self.queue.put(request)
+
+    def add_handler(self, handler: Handler) -> None:
+        def add() -> None:
+            self.listener.handlers += (handler,)
+        self.call(add)
+
+    def remove_handler(self, handler: Handler) -> None:
+        def remove() -> None:
+            self.listener.handlers = tuple(h for h in self.listener.handlers if h is not handler)
+        self.call(remove)
+
+    def discard_replay(self) -> None:
+        self.call(self.replay_buffer.discard)
+
+    def replay(self) -> None:
+        self.call(self.replay_buffer.replay)
+
+    def close(self) -> None:
+        self.listener.stop()
@@ -21,12 +21,13 @@ Launch a Firefox browser to download PDFs from eVision.
 """
 
 import argparse
+import atexit
+import functools
 import logging
 import logging.config
-import logging.handlers
 import os
 import sys
-from typing import Any, Dict, Sequence
+from typing import Any, Dict, Optional, Sequence
 import warnings
 
 import colorama
@@ -34,14 +35,26 @@ from selenium import webdriver
 from selenium.webdriver.firefox.service import Service
 
 from evision_dl.applicant import ApplicantContextChangeListener
-from evision_dl.download import Downloader
-from evision_dl.logging import ColorFormatter
+from evision_dl.capture import DebugCapture
+from evision_dl.denylist import DocumentDenyList
+from evision_dl.download import DownloadIndex, Downloader
+from evision_dl.journal import Journal
+from evision_dl.logging import AsyncLogPipeline, ColorFormatter
+from evision_dl.metrics import MetricsFileExporter, MetricsHTTPExporter
+from evision_dl.report import ReportWriter
 from evision_dl.robot import Robot
+from evision_dl.session import HTTPSession
 from evision_dl.summary import Summarizer
+from evision_dl.timeouts import timeouts
+from evision_dl.trace import CommandTracer
+from evision_dl.workers import run_workers
 from evision_dl.screen.start import StartScreen
 
 logger = logging.getLogger(__name__)
 
+# Memory for the instant replay of recent log messages
+REPLAY_LOG_BYTES = 8 << 20
+
 def parse_args(args:Sequence[str]) -> Dict[str, Any]:
     parser = argparse.ArgumentParser(description=__doc__)
     parser.add_argument('dest_dir',
@@ -50,14 +63,72 @@ def parse_args(args:Sequence[str]) -> Dict[str, Any]:
         help='Python logging configuration (see https://docs.python.org/3/library/logging.config.html#logging-config-fileformat)')
     parser.add_argument('--webdriver-log', metavar='webdriver.log', default=os.devnull,
         help='Webdriver log file (such as geckodriver.log)')
+    parser.add_argument('--fsync', action='store_true',
+        help='Flush each downloaded PDF to stable storage before renaming it into place')
+    parser.add_argument('--download-workers', metavar='N', type=int, default=2,
+        help='Number of PDFs to download concurrently in the background')
+    parser.add_argument('--download-queue', metavar='N', type=int, default=4,
+        help='Number of PDFs that may wait for a download worker before the robot pauses')
+    parser.add_argument('--http-timeout', metavar='SECONDS', type=float, default=60,
+        help='Timeout for connecting to and reading from eVision when downloading PDFs')
+    parser.add_argument('--journal', metavar='journal.sqlite', default=None,
+        help='Database in which to record the progress of the run, for use by --resume')
+    parser.add_argument('--resume', action='store_true',
+        help='Skip applicants whose PDFs were already downloaded, according to the journal if given, or else the contents of the destination directory')
+    parser.add_argument('--deny-list', metavar='deny-list.json', default=None,
+        help='File in which to learn which types of documents break PDF merges, so that they can be excluded in advance')
+    parser.add_argument('--report', metavar='report.csv', default=None,
+        help='File to which to append a row for each applicant as it is done (CSV, or JSON lines if named *.jsonl)')
+    parser.add_argument('--browsers', metavar='N', type=int, default=1,
+        help='Number of Firefox windows to drive in parallel (log into each, and open the same application in each)')
+    parser.add_argument('--profile', metavar='DIR', default=None,
+        help='Firefox profile directory to reuse, so that the eVision session survives a restart (created if necessary)')
+    parser.add_argument('--headless', action='store_true',
+        help='Run Firefox without a window; requires --profile with a logged-in session, and --start-url')
+    parser.add_argument('--start-url', metavar='URL', default=None,
+        help='Page at which to start, such as the URL of an application window from a previous run (default: {})'.format(StartScreen.URL))
+    parser.add_argument('--metrics-file', metavar='metrics.prom', default=None,
+        help='File to which to write timing histograms of screens and downloads, in the Prometheus text format, every few seconds')
+    parser.add_argument('--metrics-port', metavar='PORT', type=int, default=None,
+        help='Serve timing histograms at http://127.0.0.1:PORT/metrics')
+    parser.add_argument('--trace', metavar='trace.json', default=None,
+        help='File to which to write a timeline of WebDriver commands, for chrome://tracing or https://ui.perfetto.dev/')
+    parser.add_argument('--timeouts', metavar='timeouts.json', default=None,
+        help='File in which to keep how long eVision takes to respond, from which timeouts are learned across runs')
+    parser.add_argument('--debug-capture', metavar='DIR', default=None,
+        help='Directory in which to keep compressed DEBUG logs, page sources, and screenshots of applicants that fail or have caveats')
     ns = parser.parse_args(args)
     if not os.path.isdir(ns.dest_dir):
         print("Directory '{0}' does not exist".format(ns.dest_dir), file=sys.stderr)
         return {}
+    if ns.headless and not ns.profile:
+        print("--headless requires --profile with an established eVision session", file=sys.stderr)
+        return {}
+    if ns.headless and not ns.start_url:
+        # Nobody can open the application window in a browser without a window
+        print("--headless requires --start-url, such as the application window URL logged by a previous run", file=sys.stderr)
+        return {}
     return {
         'dest_dir': ns.dest_dir,
         'log_config': ns.log_config,
         'webdriver_log': ns.webdriver_log,
+        'fsync': ns.fsync,
+        'download_workers': max(1, ns.download_workers),
+        'download_queue': max(0, ns.download_queue),
+        'http_timeout': ns.http_timeout,
+        'journal': ns.journal,
+        'resume': ns.resume,
+        'browsers': max(1, ns.browsers),
+        'deny_list': ns.deny_list,
+        'report': ns.report,
+        'profile': ns.profile,
+        'headless': ns.headless,
+        'start_url': ns.start_url or StartScreen.URL,
+        'metrics_file': ns.metrics_file,
+        'metrics_port': ns.metrics_port,
+        'trace': ns.trace,
+        'debug_capture': ns.debug_capture,
+        'timeouts': ns.timeouts,
     }
 
 def main(*argv:str) -> int:
@@ -69,48 +140,137 @@ def main(*argv:str) -> int:
     colorama.init()
     if log_config := args.pop('log_config'):
         logging.config.fileConfig(log_config)
-        debug_log_replay_handler = None
+        log_pipeline = None
     else:
         formatter = ColorFormatter(
             style='{',
-            fmt="{asctime}s [{levelname}] @{name} {message:.1200}",
+            fmt=(
+                "{asctime}s [{levelname}] {threadName} @{name} {message:.1200}"
+                if args['browsers'] > 1 else
+                "{asctime}s [{levelname}] @{name} {message:.1200}"
+            ),
         )
 
         normal_log_handler = logging.StreamHandler()
         normal_log_handler.setLevel(logging.INFO)
         normal_log_handler.setFormatter(formatter)
 
-        debug_log_replay_handler = logging.handlers.MemoryHandler(
-            capacity=4096,
-            flushLevel=2*logging.CRITICAL,
-            target=normal_log_handler,
-            flushOnClose=False,
-        )
-        debug_log_replay_handler.setLevel(logging.DEBUG)
-        debug_log_replay_handler.setFormatter(formatter)
+        # Records are formatted and written on a background thread, and the
+        # recent ones are kept for an instant replay of the DEBUG messages
+        log_pipeline = AsyncLogPipeline(normal_log_handler, replay_capacity=REPLAY_LOG_BYTES)
+        atexit.register(log_pipeline.close)
 
         logging.basicConfig(
             level=logging.DEBUG,
-            handlers=[normal_log_handler, debug_log_replay_handler],
+            handlers=[log_pipeline.queue_handler],
         )
  
+    try:
+        report_writer = ReportWriter(args['report']) if args['report'] else None
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 1
+
+    webdriver_log = args.pop('webdriver_log')
+    drivers = [
+        launch_firefox(
+            webdriver_log,
+            profile_dir=profile_dir_for_browser(args['profile'], i, args['browsers']),
+            headless=args['headless'],
+        )
+        for i in range(args['browsers'])
+    ]
+    start_screen = functools.partial(StartScreen, url=args['start_url'])
+
+    journal = Journal(args['journal']) if args['journal'] else None
+    if not args['resume']:
+        completed = frozenset()
+    elif journal:
+        logger.info("Journal of previous runs: {}".format(journal.outcome_counts()))
+        # Applicants that did not finish in a previous run are tried again
+        for outcome in (Journal.STARTED, Journal.GENERATION_FAILED, Journal.DOWNLOAD_FAILED):
+            for applicant, _ in journal.applicants_with_outcome(outcome):
+                logger.info("To retry, after {} in a previous run: {}".format(outcome, applicant))
+        completed = journal
+    else:
+        completed = DownloadIndex(args['dest_dir'])
+
+    deny_list = DocumentDenyList(args['deny_list']) if args['deny_list'] else None
+
+    robot = Robot(drivers[0], completed=completed, unwanted_doc_types=deny_list if deny_list is not None else ())
+    robots = [robot] + [robot.spawn(driver) for driver in drivers[1:]]
+    robot.add_event_listener(ApplicantContextChangeListener())
+    if args['trace']:
+        tracer = CommandTracer(args['trace'])
+        for r in robots:
+            tracer.attach(r)
+        robot.add_event_listener(tracer)
+    if args['debug_capture']:
+        robot.add_event_listener(DebugCapture(args['debug_capture'], log_pipeline))
+    robot.add_event_listener(Downloader(
+        args['dest_dir'],
+        fsync=args['fsync'],
+        workers=args['download_workers'],
+        queue_size=args['download_queue'],
+        session=HTTPSession(
+            max_connections_per_host=args['download_workers'],
+            timeout=args['http_timeout'],
+        ),
+    ))
+    if journal:
+        robot.add_event_listener(journal, asynchronous=True)
+    if deny_list is not None:
+        robot.add_event_listener(deny_list)
+    if report_writer is not None:
+        robot.add_event_listener(report_writer)
+    robot.add_event_listener(Summarizer(log_pipeline, robots=len(robots)))
+
+    if args['timeouts']:
+        timeouts.load(args['timeouts'])
+    exporters = []
+    if args['metrics_file']:
+        exporters.append(MetricsFileExporter(args['metrics_file']))
+    if args['metrics_port'] is not None:
+        exporters.append(MetricsHTTPExporter(args['metrics_port']))
+    try:
+        if len(robots) == 1:
+            return robot.run(start_screen)
+        else:
+            return run_workers(robots, start_screen)
+    finally:
+        for exporter in exporters:
+            exporter.close()
+        if args['timeouts']:
+            timeouts.save(args['timeouts'])
+
+def profile_dir_for_browser(profile_dir: Optional[str], i: int, browsers: int) -> Optional[str]:
+    # Firefox locks its profile, so each browser needs its own
+    if profile_dir is None or browsers == 1:
+        return profile_dir
+    return os.path.join(profile_dir, 'browser-{}'.format(i + 1))
+
+def launch_firefox(webdriver_log: str, profile_dir: Optional[str] = None, headless: bool = False) -> webdriver.Firefox:
     capabilities = webdriver.DesiredCapabilities().FIREFOX.copy()
     capabilities['acceptInsecureCerts'] = False
+    options = webdriver.FirefoxOptions()
+    if profile_dir:
+        # Use the profile in place, rather than a temporary copy, so that
+        # cookies and cache persist
+        os.makedirs(profile_dir, exist_ok=True)
+        options.add_argument('-profile')
+        options.add_argument(os.path.abspath(profile_dir))
+    if headless:
+        options.add_argument('-headless')
     with warnings.catch_warnings():
         # It seems that Selenium has deprecated every reasonable way to
         # configure Firefox settings!  We need to suppress the warning
         # about Capabilities being deprecated.
         warnings.filterwarnings("ignore", category=DeprecationWarning)
-        driver = webdriver.Firefox(
+        return webdriver.Firefox(
             capabilities=capabilities,
-            service=Service(log_path=args.pop('webdriver_log'))
+            options=options,
+            service=Service(log_path=webdriver_log)
         )
 
-    robot = Robot(driver)
-    robot.add_event_listener(ApplicantContextChangeListener())
-    robot.add_event_listener(Downloader(args['dest_dir']))
-    robot.add_event_listener(Summarizer(debug_log_replay_handler))
-    return robot.run(StartScreen)
-
 if __name__ == '__main__':
     sys.exit(main() or 0)
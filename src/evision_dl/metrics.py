@@ -0,0 +1,219 @@
+# Copyright 2003 Dara Poon and the University of British Columbia
+#
+# This file is part of evision-dl.
+#
+# evision-dl is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# evision-dl is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# evision-dl. If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Timing metrics, aggregated into histograms, and counters, exported in the
+Prometheus text format to a file or a local HTTP endpoint.
+"""
+
+from bisect import bisect_left
+from contextlib import contextmanager
+import functools
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import logging
+import os
+from threading import Event as ThreadingEvent, Lock, Thread
+import time
+from typing import Any, Callable, Dict, Iterator, List, Tuple, TypeVar
+
+logger = logging.getLogger(__name__)
+
+PREFIX = 'evision_dl_'
+
+# Upper bounds of histogram buckets, in seconds
+BUCKETS = (
+    0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+    1, 2.5, 5, 10, 25, 50,
+    100, 250, 500, 1000, 2500, float('inf'),
+)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+######################################################################
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(BUCKETS, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q: float) -> float:
+        """
+        Estimate the q-quantile by interpolating within its bucket.
+        """
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        cumulative = 0
+        for i, count in enumerate(self.counts):
+            if count and cumulative + count >= rank:
+                lower = BUCKETS[i - 1] if i else 0.0
+                upper = min(BUCKETS[i], self.max)
+                return lower + (upper - lower) * (rank - cumulative) / count
+            cumulative += count
+        return self.max
+
+######################################################################
+
+class Metrics:
+    """
+    A thread-safe registry of timing histograms and counters, keyed by metric
+    name and labels.
+    """
+
+    QUANTILES = (0.5, 0.95)
+
+    def __init__(self):
+        self.lock = Lock()
+        self.histograms: Dict[str, Dict[Labels, Histogram]] = {}
+        self.counters: Dict[str, Dict[Labels, float]] = {}
+
+    def observe(self, name: str, seconds: float, **labels: str) -> None:
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            family = self.histograms.setdefault(name, {})
+            if key not in family:
+                family[key] = Histogram()
+            family[key].observe(seconds)
+
+    def increment(self, name: str, amount: float = 1, **labels: str) -> None:
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            family = self.counters.setdefault(name, {})
+            family[key] = family.get(key, 0) + amount
+
+    @contextmanager
+    def timer(self, name: str, **labels: str) -> Iterator[None]:
+        start_time = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(name, time.monotonic() - start_time, **labels)
+
+    def render(self) -> str:
+        lines: List[str] = []
+        with self.lock:
+            for name, family in sorted(self.histograms.items()):
+                metric = PREFIX + name
+                lines.append('# TYPE {} histogram'.format(metric))
+                for labels, histogram in sorted(family.items()):
+                    cumulative = 0
+                    for bound, count in zip(BUCKETS, histogram.counts):
+                        cumulative += count
+                        le = '+Inf' if bound == float('inf') else repr(bound)
+                        lines.append('{}_bucket{} {}'.format(metric, _format_labels(labels + (('le', le),)), cumulative))
+                    lines.append('{}_sum{} {}'.format(metric, _format_labels(labels), histogram.sum))
+                    lines.append('{}_count{} {}'.format(metric, _format_labels(labels), histogram.count))
+                lines.append('# TYPE {}_quantile gauge'.format(metric))
+                for labels, histogram in sorted(family.items()):
+                    for q in self.QUANTILES:
+                        lines.append('{}_quantile{} {}'.format(metric, _format_labels(labels + (('quantile', str(q)),)), histogram.quantile(q)))
+                    lines.append('{}_quantile{} {}'.format(metric, _format_labels(labels + (('quantile', '1'),)), histogram.max))
+            for name, counters in sorted(self.counters.items()):
+                metric = PREFIX + name
+                lines.append('# TYPE {} counter'.format(metric))
+                for labels, value in sorted(counters.items()):
+                    lines.append('{}{} {}'.format(metric, _format_labels(labels), value))
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path: str) -> None:
+        tmp_path = path + os.path.extsep + 'part'
+        with open(tmp_path, 'w') as f:
+            f.write(self.render())
+        os.replace(tmp_path, path)
+
+def _format_labels(labels: Labels) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(
+        '{}="{}"'.format(k, v.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for k, v in labels
+    ) + '}'
+
+# The registry used throughout the program
+metrics = Metrics()
+
+F = TypeVar('F', bound=Callable[..., Any])
+
+def timed(name: str) -> Callable[[F], F]:
+    """
+    Decorator for methods of screens, to time each call, labelled with the
+    class of the screen.
+    """
+    def decorator(method: F) -> F:
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            with metrics.timer(name, screen=type(self).__name__):
+                return method(self, *args, **kwargs)
+        return wrapper      # type: ignore
+    return decorator
+
+######################################################################
+
+class MetricsFileExporter:
+    """
+    Periodically rewrites a file with the metrics, for a Prometheus
+    node_exporter textfile collector or for a human to inspect.
+    """
+    def __init__(self, path: str, interval: float = 10, registry: Metrics = metrics):
+        self.path = path
+        self.interval = interval
+        self.registry = registry
+        self.stopping = ThreadingEvent()
+        self.thread = Thread(target=self._run, name='metrics-file', daemon=True)
+        self.thread.start()
+
+    def _run(self) -> None:
+        while not self.stopping.wait(self.interval):
+            self.registry.write(self.path)
+
+    def close(self) -> None:
+        self.stopping.set()
+        self.thread.join()
+        self.registry.write(self.path)
+
+class MetricsHTTPExporter:
+    """
+    Serves the metrics at http://127.0.0.1:port/metrics.
+    """
+    def __init__(self, port: int, registry: Metrics = metrics):
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:
+                body = registry.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format: str, *args: Any) -> None:
+                logger.debug(format % args)
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+        self.thread = Thread(target=self.server.serve_forever, name='metrics-http', daemon=True)
+        self.thread.start()
+        logger.info("Serving metrics at http://127.0.0.1:{}/metrics".format(self.server.server_port))
+
+    def close(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
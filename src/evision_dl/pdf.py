@@ -0,0 +1,100 @@
+# Copyright 2003 Dara Poon and the University of British Columbia
+#
+# This file is part of evision-dl.
+#
+# evision-dl is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# evision-dl is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# evision-dl. If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Validation of PDFs as they are downloaded, so that an error page or a
+truncated transfer is not mistaken for a PDF.
+"""
+
+import re
+from typing import Optional
+
+class InvalidPDFError(Exception):
+    pass
+
+class PDFValidator:
+    """
+    Checks a PDF chunk by chunk as it streams in, without holding it in
+    memory.  feed() raises InvalidPDFError as soon as the data cannot be a
+    PDF; close() checks that the PDF is complete.  Along the way, the pages
+    and the encryption dictionary are noticed, unless they are in compressed
+    object streams, in which case page_count remains None.
+    """
+
+    # Content types with which a PDF might be served
+    CONTENT_TYPES = ('application/pdf', 'application/x-pdf', 'application/octet-stream', 'binary/octet-stream')
+
+    # Readers accept a header anywhere in the first kilobyte
+    HEADER = b'%PDF-'
+    HEADER_WINDOW = 1024
+    # The end-of-file marker is required within the last kilobyte
+    TRAILER_WINDOW = 1024
+
+    PAGE_RE = re.compile(rb'/Type\s{0,8}/Page(?![A-Za-z])')
+    ENCRYPT_RE = re.compile(rb'/Encrypt(?![A-Za-z])')
+    # Longer than any match, plus the character after it
+    CARRY = 64
+
+    def __init__(self, content_type: Optional[str] = None, content_length: Optional[int] = None):
+        media_type = (content_type or '').split(';')[0].strip().lower()
+        if media_type and media_type not in self.CONTENT_TYPES:
+            raise InvalidPDFError("Expected a PDF, but got {}".format(media_type))
+        self.content_length = content_length
+        self.size = 0
+        self.header_seen = False
+        self.head = b''
+        self.tail = b''
+        self.pending = b''
+        self.pages = 0
+        self.encrypted = False
+
+    @property
+    def page_count(self) -> Optional[int]:
+        return self.pages or None
+
+    def feed(self, chunk: bytes) -> None:
+        self.size += len(chunk)
+        if self.content_length is not None and self.size > self.content_length:
+            raise InvalidPDFError("Received more than the {} bytes announced".format(self.content_length))
+        if not self.header_seen:
+            self.head = (self.head + chunk)[:self.HEADER_WINDOW]
+            if self.HEADER in self.head:
+                self.header_seen = True
+            elif len(self.head) >= self.HEADER_WINDOW:
+                raise InvalidPDFError("No PDF header, but {!r}".format(self.head[:60]))
+        self.tail = (self.tail + chunk)[-self.TRAILER_WINDOW:]
+        # Scan all but the last few bytes, which are held back in case a
+        # match spans chunks
+        data = self.pending + chunk
+        self._scan(data, len(data) - self.CARRY)
+        self.pending = data[-self.CARRY:]
+
+    def close(self) -> None:
+        self._scan(self.pending, len(self.pending))
+        self.pending = b''
+        if self.content_length is not None and self.size < self.content_length:
+            raise InvalidPDFError("Truncated after {} of {} bytes".format(self.size, self.content_length))
+        if not self.header_seen:
+            raise InvalidPDFError("No PDF header, but {!r}".format(self.head[:60]))
+        if b'%%EOF' not in self.tail or b'startxref' not in self.tail:
+            raise InvalidPDFError("Truncated: no startxref and %%EOF at the end, after {} bytes".format(self.size))
+
+    def _scan(self, data: bytes, end: int) -> None:
+        # Only count matches that start before end; the rest are rescanned
+        # with the next chunk
+        self.pages += sum(1 for m in self.PAGE_RE.finditer(data) if m.start() < end)
+        if not self.encrypted:
+            self.encrypted = any(m.start() < end for m in self.ENCRYPT_RE.finditer(data))
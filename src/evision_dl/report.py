@@ -0,0 +1,167 @@
+# Copyright 2003 Dara Poon and the University of British Columbia
+#
+# This file is part of evision-dl.
+#
+# evision-dl is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# evision-dl is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# evision-dl. If not, see <https://www.gnu.org/licenses/>.
+
+import csv
+import json
+import logging
+import os
+import time
+from typing import Any, Dict, Optional
+
+from .applicant import Applicant, ApplicantContextChangeEvent, ApplicantSkippedEvent
+from .download import (
+    PDFGenerationCaveatEvent,
+    PDFGenerationFailureEvent,
+    PDFGenerationSuccessEvent,
+    PDFDownloadFailureEvent,
+    PDFDownloadSuccessEvent,
+)
+from .event import Event, EventListener
+from .robot import Robot, RobotFinishingEvent
+
+logger = logging.getLogger(__name__)
+
+######################################################################
+
+class ReportWriter(EventListener):
+    """
+    Writes one row per applicant to a CSV file (or, if the filename ends in
+    .jsonl, a JSON object per line) as soon as the applicant's outcome is
+    known, flushing each row so that the report can be followed while the
+    robot runs.  Only applicants still in progress are kept in memory.
+
+    Rows are appended to an existing report, which must have the same
+    columns.  Raises ValueError for a report that can't be appended to.
+    """
+
+    event_types = (
+        ApplicantContextChangeEvent,
+        ApplicantSkippedEvent,
+        PDFGenerationCaveatEvent,
+        PDFGenerationFailureEvent,
+        PDFGenerationSuccessEvent,
+        PDFDownloadFailureEvent,
+        PDFDownloadSuccessEvent,
+        RobotFinishingEvent,
+    )
+
+    FIELDS = (
+        'student_number',
+        'surname',
+        'preferred_name',
+        'outcome',
+        'dest_path',
+        'size',
+        'page_count',
+        'generation_duration',
+        'download_duration',
+        'problematic_documents',
+        'message',
+    )
+
+    def __init__(self, path: str):
+        self.path = path
+        ext = os.path.splitext(path)[1].lower()
+        if ext == '.json':
+            raise ValueError("Report {} would not be a JSON document; name it *.jsonl for JSON lines".format(path))
+        self.json = ext == '.jsonl'
+        self.file = open(path, 'a+', newline='')
+        self.csv_writer = csv.DictWriter(self.file, fieldnames=self.FIELDS)
+        if not self.json:
+            self.file.seek(0)
+            header = next(csv.reader(self.file), None)
+            if header is None:
+                self.csv_writer.writeheader()
+            elif header != list(self.FIELDS):
+                self.file.close()
+                raise ValueError("Report {} has different columns; use another file".format(path))
+        # Rows for applicants whose outcome isn't known yet, by student number
+        self.rows: Dict[str, Dict[str, Any]] = {}
+        # The applicant being processed by each robot, and when it started
+        self.current_applicants: Dict[Robot, Applicant] = {}
+        self.start_times: Dict[Robot, float] = {}
+
+    def handle_event(self, robot: Robot, event: Event) -> None:
+        applicant = self.current_applicants.get(robot)
+        if isinstance(event, ApplicantContextChangeEvent):
+            if event.applicant is None:
+                self.current_applicants.pop(robot, None)
+                self.start_times.pop(robot, None)
+            else:
+                self.current_applicants[robot] = event.applicant
+                self.start_times[robot] = time.monotonic()
+                self.rows[event.applicant.student_number] = self._new_row(event.applicant)
+        elif isinstance(event, ApplicantSkippedEvent):
+            row = self._new_row(event.applicant)
+            row['outcome'] = 'skipped'
+            self._write(row)
+        elif isinstance(event, PDFGenerationCaveatEvent):
+            assert applicant is not None
+            if row := self._row(applicant):
+                row['problematic_documents'] = '; '.join(event.problems)
+        elif isinstance(event, PDFGenerationSuccessEvent):
+            assert applicant is not None
+            if row := self._row(applicant):
+                row['generation_duration'] = round(time.monotonic() - self.start_times[robot], 3)
+        elif isinstance(event, PDFGenerationFailureEvent):
+            assert applicant is not None
+            if row := self._row(applicant, pop=True):
+                row['generation_duration'] = round(time.monotonic() - self.start_times[robot], 3)
+                row['outcome'] = 'generation failed'
+                row['message'] = event.message
+                self._write(row)
+        elif isinstance(event, PDFDownloadFailureEvent):
+            if row := self._row(event.applicant, pop=True):
+                row['outcome'] = 'download failed'
+                row['message'] = str(event.exception)
+                self._write(row)
+        elif isinstance(event, PDFDownloadSuccessEvent):
+            if row := self._row(event.applicant, pop=True):
+                row['outcome'] = 'downloaded'
+                row['dest_path'] = event.dest_path
+                row['size'] = event.size
+                row['page_count'] = event.page_count
+                row['download_duration'] = round(event.duration, 3)
+                self._write(row)
+        elif isinstance(event, RobotFinishingEvent):
+            for row in self.rows.values():
+                row['outcome'] = 'incomplete'
+                if event.exception is not None:
+                    row['message'] = "crashed: {}".format(event.exception)
+                self._write(row)
+            self.rows.clear()
+            self.file.close()
+
+    def _new_row(self, applicant: Applicant) -> Dict[str, Any]:
+        row: Dict[str, Any] = dict.fromkeys(self.FIELDS)
+        row.update(
+            student_number=applicant.student_number,
+            surname=applicant.surname,
+            preferred_name=applicant.preferred_name,
+        )
+        return row
+
+    def _row(self, applicant: Applicant, pop: bool = False) -> Optional[Dict[str, Any]]:
+        if pop:
+            return self.rows.pop(applicant.student_number, None)
+        return self.rows.get(applicant.student_number)
+
+    def _write(self, row: Dict[str, Any]) -> None:
+        if self.json:
+            self.file.write(json.dumps(row) + '\n')
+        else:
+            self.csv_writer.writerow(row)
+        self.file.flush()
@@ -15,17 +15,27 @@
 # evision-dl. If not, see <https://www.gnu.org/licenses/>.
 
 import logging
-from typing import Optional, Type
+from queue import Empty, SimpleQueue
+from threading import Event as ThreadingEvent, RLock
+from typing import Callable, Collection, Container, Iterable, Optional, Set, Tuple, Type
 
 from selenium.webdriver.remote.webdriver import WebDriver
 
-from .event import Event, EventListener
+from .event import Event, EventBus, EventListener
+from .metrics import metrics
 from .screen import Screen
 
 logger = logging.getLogger(__name__)
 
 ######################################################################
 
+class RobotDrainingEvent(Event):
+    """
+    Posted when the robot has no more screens to process, just before the
+    RobotFinishingEvent, so that listeners with work in the background can
+    wait for it and post its results while every listener still wants them.
+    """
+
 class RobotFinishingEvent(Event):
     def __init__(self, exception:Optional[Exception]=None):
         self.exception = exception
@@ -33,30 +43,113 @@ class RobotFinishingEvent(Event):
 ######################################################################
 
 class Robot:
-    def __init__(self, driver: WebDriver):
+    def __init__(self, driver: WebDriver, completed: Container[str] = frozenset(), unwanted_doc_types: Collection[str] = ()):
         self.driver = driver
-        self.event_listeners = set()
+        # Student numbers of applicants whose PDFs need not be downloaded again
+        self.completed = completed
+        # Types of documents to exclude from PDFs, in addition to the usual ones
+        self.unwanted_doc_types = unwanted_doc_types
+        # The screen being processed
+        self.screen: Optional[Screen] = None
+        self.event_bus = EventBus()
+        self.pending_events: SimpleQueue = SimpleQueue()
+        # The following are shared with robots created by spawn()
+        self.event_lock = RLock()
+        self.claimed: Set[str] = set()
+        self.stop_requested = ThreadingEvent()
+
+    def spawn(self, driver: WebDriver) -> 'Robot':
+        """
+        Create another robot, driving another browser, that shares this
+        robot's event listeners, so that both feed the same pipeline.  The
+        robots cooperate so that each applicant is claimed by only one of
+        them.
+        """
+        robot = Robot(driver, self.completed, self.unwanted_doc_types)
+        robot.event_bus = self.event_bus
+        robot.pending_events = self.pending_events
+        robot.event_lock = self.event_lock
+        robot.claimed = self.claimed
+        robot.stop_requested = self.stop_requested
+        return robot
 
-    def add_event_listener(self, listener: EventListener) -> None:
-        self.event_listeners.add(listener)
+    def claim(self, student_number: str) -> bool:
+        """
+        Claim an applicant for processing by this robot.  Returns False if
+        the applicant has already been claimed.
+        """
+        with self.event_lock:
+            if student_number in self.claimed:
+                return False
+            self.claimed.add(student_number)
+            return True
+
+    def add_event_listener(self, listener: EventListener, event_types: Optional[Iterable[Type[Event]]] = None, asynchronous: bool = False) -> None:
+        """
+        Subscribe the listener to events of the given types (by default, its
+        event_types).  Listeners are notified in the order in which they were
+        added.  An asynchronous listener handles events on its own thread.
+        """
+        self.event_bus.subscribe(listener, event_types, asynchronous)
 
     def post_event(self, event: Event) -> None:
-        # TODO: exception handling
-        for listener in self.event_listeners:
-            listener.handle_event(self, event)
+        """
+        Dispatch the event to the listeners.  An exception raised by a
+        listener propagates, once the other listeners have handled the event
+        and the events it caused; see EventBus.dispatch().
+        """
+        with self.event_lock:
+            self.event_bus.dispatch(self, event)
+
+    def post_event_threadsafe(self, event: Event) -> None:
+        """
+        Queue an event from a background thread, to be dispatched on the
+        robot's thread by dispatch_pending_events().
+        """
+        self.pending_events.put(event)
+
+    def dispatch_pending_events(self) -> None:
+        while True:
+            try:
+                event = self.pending_events.get_nowait()
+            except Empty:
+                return
+            self.post_event(event)
+
+    def run(self, initial_screen_class: Callable[['Robot'], Screen]) -> int:
+        status, exception = self.run_screens(initial_screen_class)
+        self.finish(exception)
+        return status
+
+    def finish(self, exception: Optional[Exception] = None) -> None:
+        self.post_event(RobotDrainingEvent())
+        self.dispatch_pending_events()
+        self.post_event(RobotFinishingEvent(exception))
+        self.event_bus.close()
 
-    def run(self, initial_screen_class: Type[Screen]) -> int:
+    def run_screens(self, initial_screen_class: Callable[['Robot'], Screen]) -> Tuple[int, Optional[Exception]]:
+        """
+        Process screens until there are no more, without posting a
+        RobotFinishingEvent.  Returns the exit status, and the exception that
+        caused the robot to crash, if any.
+        """
         try:
             screen = initial_screen_class(self)
             while screen:
-                screen = screen.process()
-            self.post_event(RobotFinishingEvent())
-            return 0
+                if self.stop_requested.is_set():
+                    logger.error("Stopping")
+                    return 2, None
+                self.screen = screen
+                with metrics.timer('screen_seconds', screen=type(screen).__name__):
+                    screen = screen.process()
+                self.dispatch_pending_events()
+            return 0, None
         except KeyboardInterrupt:
             logger.error("Keyboard interrupt")
-            self.post_event(RobotFinishingEvent())
-            return 2
+            return 2, None
         except Exception as e:
+            if self.stop_requested.is_set():
+                logger.error("Stopped with {}".format(type(e).__name__))
+                return 2, None
             logger.critical("Crashed with uncaught exception", exc_info=e)
-            self.post_event(RobotFinishingEvent(e))
-            return 1
+            return 1, e
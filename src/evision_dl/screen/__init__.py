@@ -15,21 +15,26 @@
 # evision-dl. If not, see <https://www.gnu.org/licenses/>.
 
 from __future__ import annotations
+from collections import namedtuple
 import logging
-from typing import Any, Dict, Callable, Optional, TYPE_CHECKING
+import time
+from typing import Any, Dict, Callable, List, Optional, TYPE_CHECKING
 
 from selenium.common.exceptions import (
     ElementClickInterceptedException,
-    NoSuchElementException,
+    JavascriptException,
     StaleElementReferenceException,
+    TimeoutException,
+    WebDriverException,
 )
-from selenium.webdriver.common.by import By
 from selenium.webdriver.remote.webdriver import WebDriver
 from selenium.webdriver.remote.webelement import WebElement
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.support.wait import WebDriverWait
 
 from .. import expected_conditions as EVEC
+from ..backoff import RetryPolicy
+from ..metrics import timed
 if TYPE_CHECKING:
     from ..robot import Robot
 
@@ -37,6 +42,64 @@ logger = logging.getLogger(__name__)
 
 ######################################################################
 
+# A checkbox in the document list of the Manage Applicant PDF window.  The id
+# is the checkbox's name and value, joined by a double-quote character.
+Document = namedtuple('Document', 'id label checked italic')
+
+# A tab in the application window
+Tab = namedtuple('Tab', 'title selected')
+
+class PageSnapshot(namedtuple('PageSnapshot', 'docs tabs overlay')):
+    """
+    The state of the parts of the page that the screens care about, as
+    captured by Screen.snapshot() in a single WebDriver round trip.
+    """
+    docs: List[Document]
+    tabs: List[Tab]
+    overlay: Optional['ModalOverlay']
+
+    def doc_ids(self, include_italic: bool = False) -> Dict[str, str]:
+        return {doc.id: doc.label for doc in self.docs if include_italic or not doc.italic}
+
+SNAPSHOT_SCRIPT = '''
+    var text = function (el) {
+        return el ? el.innerText.trim() : '';
+    };
+    var docs = [];
+    document.querySelectorAll('label[class="pdf-check"]').forEach(function (label) {
+        var checkbox = label.querySelector('input[type="checkbox"]');
+        // Skip the "Select all documents" checkbox, which has no name
+        if (!checkbox || !checkbox.getAttribute('name')) return;
+        docs.push({
+            id: checkbox.name + '"' + checkbox.value,
+            label: text(label),
+            checked: checkbox.checked,
+            italic: (label.getAttribute('style') || '').indexOf('italic') >= 0
+        });
+    });
+    var tabs = [];
+    document.querySelectorAll('li[role="tab"]').forEach(function (li) {
+        tabs.push({title: li.getAttribute('title'), selected: li.getAttribute('aria-selected') === 'true'});
+    });
+    var overlay = null;
+    var title = document.querySelector('div.ui-dialog .ui-dialog-title');
+    if (title) {
+        var buttons = [];
+        document.querySelectorAll('div.ui-dialog .ui-dialog-buttonset > button').forEach(function (button) {
+            buttons.push([text(button), button]);
+        });
+        overlay = {
+            titleElement: title,
+            title: text(title),
+            content: text(document.querySelector('div.ui-dialog .ui-dialog-content')),
+            buttons: buttons
+        };
+    }
+    return {docs: docs, tabs: tabs, overlay: overlay};
+'''
+
+######################################################################
+
 # Abstract class
 class Screen:
     def __init__(self, robot: 'Robot'):
@@ -50,6 +113,65 @@ class Screen:
         logger.critical("{}.process() is unimplemented".format(self))
         raise NotImplementedError
 
+    def snapshot(self) -> PageSnapshot:
+        """
+        Capture the document list, tabs, and modal overlay of the current
+        page, with one script rather than a round trip per element.
+        """
+        result = self.driver.execute_script(SNAPSHOT_SCRIPT)
+        overlay = result['overlay']
+        return PageSnapshot(
+            docs=[Document(d['id'], d['label'], d['checked'], d['italic']) for d in result['docs']],
+            tabs=[Tab(t['title'], t['selected']) for t in result['tabs']],
+            overlay=overlay and ModalOverlay(
+                self,
+                overlay['titleElement'],
+                overlay['title'],
+                overlay['content'],
+                dict(overlay['buttons']),
+            ),
+        )
+
+    # Longest time for which a single asynchronous script may wait, which must
+    # be less than the WebDriver's script timeout (30 s by default)
+    MUTATION_WAIT_SLICE = 20
+    # A script aborted by navigation is retried once the next page has had a
+    # moment to load; if scripts keep being aborted, polling takes over
+    SCRIPT_ABORT_DELAY = 0.1
+    MAX_SCRIPT_ABORTS = 5
+
+    def wait(self, condition: Callable[[WebDriver], Any], timeout: float = 30) -> Any:
+        """
+        Like WebDriverWait(self.driver, timeout).until(condition), but if the
+        condition is a js_condition, wait for it within the page, returning
+        as soon as a DOM mutation makes it true.
+        """
+        if not isinstance(condition, EVEC.js_condition):
+            return WebDriverWait(self.driver, timeout).until(condition)
+        deadline = time.monotonic() + timeout
+        script = condition.async_script()
+        aborts = 0
+        while (remaining := deadline - time.monotonic()) > 0:
+            wait_slice = min(remaining, self.MUTATION_WAIT_SLICE)
+            try:
+                result = self.driver.execute_async_script(script, list(condition.args), int(wait_slice * 1000))
+            except JavascriptException:
+                # Navigating to another page aborts the script
+                aborts += 1
+                if aborts >= self.MAX_SCRIPT_ABORTS:
+                    logger.debug("MutationObserver script aborted {} times in a row; polling instead".format(aborts))
+                    return WebDriverWait(self.driver, max(deadline - time.monotonic(), 0)).until(condition)
+                time.sleep(self.SCRIPT_ABORT_DELAY)
+                continue
+            except WebDriverException as e:
+                logger.debug("Unable to wait using MutationObserver ({}); polling instead".format(e.msg))
+                return WebDriverWait(self.driver, remaining).until(condition)
+            aborts = 0
+            if result:
+                return result
+        raise TimeoutException("Timed out after {} s waiting for {}".format(timeout, condition.body.strip()))
+
+    @timed('open_window_seconds')
     def open_window(self, action: Callable[[], Any] = lambda: None, expectation: Callable[[WebDriver], bool] = lambda d: True, timeout: float=float('inf')) -> str:
         # Note: the timeout clock resets every time a wrong window opens
         conditions = [expectation, EVEC.window_opened(action)]
@@ -62,32 +184,39 @@ class Screen:
                 # expectation met
                 return self.driver.current_window_handle
 
+    # Clicks that are intercepted by a modal overlay are retried as soon as the
+    # overlay is dismissed, or after backing off if it cannot be found
+    CLICK_RETRY = RetryPolicy('click', tries=90, budget=300, initial_delay=0.05, max_delay=5)
+
+    @timed('click_seconds')
     def click(self, locator, timeout: float = 30) -> None:
         logger.debug("Clicking {}".format(locator))
-        last_exception = None
-        for _ in range(90):
+        retry = self.CLICK_RETRY.start(self.robot.stop_requested)
+        while True:
             try:
-                return WebDriverWait(self.driver, timeout).until(
+                WebDriverWait(self.driver, timeout).until(
                     EC.presence_of_element_located(locator)
                 ).click()
             except ElementClickInterceptedException as e:
-                last_exception = e
-                if self._dismiss_modal_overlay():
+                overlay = ModalOverlay.find_on_screen(self)
+                if overlay is None:
+                    logger.debug("Either some unknown element is obscuring the click target, or the overlay disappeared on its own just now.  Blindly retrying click...")
+                elif self._dismiss_modal_overlay(overlay):
                     logger.debug("Dismissed obscuring overlay; retrying click {}".format(locator))
                 else:
                     logger.error("Unable to dismiss obscuring overlay; failing to click {}".format(locator))
                     raise
-        else:
-            logger.error("Giving up on dismissing any modal overlay")
-            assert last_exception is not None
-            raise last_exception
-
-    def _dismiss_modal_overlay(self) -> bool:
-        overlay = ModalOverlay.find_on_screen(self)
-        if not overlay:
-            logger.debug("Either some unknown element is obscuring the click target, or the overlay disappeared on its own just now.  Blindly retrying click...")
-            return True
-        elif overlay.title in ("Processing", "Loading"):
+                try:
+                    retry.failed(e, backoff=overlay is None)
+                except ElementClickInterceptedException:
+                    logger.error("Giving up on dismissing any modal overlay")
+                    raise
+            else:
+                retry.succeeded()
+                return
+
+    def _dismiss_modal_overlay(self, overlay: ModalOverlay) -> bool:
+        if overlay.title in ("Processing", "Loading"):
             logger.debug("Waiting for {} to disappear".format(overlay))
             return overlay.wait_for_disappearance()
         elif overlay.title == "Refresh?" and "No" in overlay.buttons:
@@ -103,15 +232,8 @@ class Screen:
 class ModalOverlay:
     @classmethod
     def find_on_screen(cls, screen: Screen) -> Optional[ModalOverlay]:
-        try:
-            title_el = screen.driver.find_element(By.CSS_SELECTOR, 'div.ui-dialog .ui-dialog-title')
-            content = screen.driver.find_element(By.CSS_SELECTOR, 'div.ui-dialog .ui-dialog-content').text
-            buttons = screen.driver.find_elements(By.CSS_SELECTOR, 'div.ui-dialog .ui-dialog-buttonset > button')
-            button_map = {b.text: b for b in buttons}
-            return cls(screen, title_el, title_el.text, content, button_map)
-        except (NoSuchElementException, StaleElementReferenceException):
-            # Overlay disappeared already
-            return None
+        # None if the overlay disappeared already
+        return screen.snapshot().overlay
 
     def __init__(self, screen: Screen, title_element: WebElement, title: str, content: str, buttons: Dict[str, WebElement] = {}):
         self.screen = screen
@@ -128,7 +250,13 @@ class ModalOverlay:
         )
 
     def wait_for_disappearance(self, timeout: float = 3600) -> bool:
-        return WebDriverWait(self.screen.driver, timeout).until(EC.staleness_of(self._title_element))
+        try:
+            return self.screen.wait(
+                EVEC.js_condition('return !document.contains(args[0]);', self._title_element),
+                timeout
+            )
+        except StaleElementReferenceException:
+            return True
 
     def click_button(self, text: str) -> None:
         try:
@@ -14,20 +14,22 @@
 # You should have received a copy of the GNU General Public License along with
 # evision-dl. If not, see <https://www.gnu.org/licenses/>.
 
-from retry import retry
 from selenium.common.exceptions import TimeoutException
 from selenium.webdriver.common.by import By
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.webdriver.support.wait import WebDriverWait
 
+from .. import expected_conditions as EVEC
+from ..backoff import RetryPolicy
+from ..metrics import timed
 from ..screen import Screen
 from ..xpath import string_literal as xpath_string
 
 class ApplicationScreen(Screen):
-    @retry(TimeoutException)
+    @timed('activate_tab_seconds')
+    @RetryPolicy('activate_tab', TimeoutException, tries=8, initial_delay=1, max_delay=30)
     def activate_tab(self, tab_label:str):
         li_xpath = '//li[@role="tab"][@title={}]'.format(xpath_string(tab_label))
         self.click((By.XPATH, li_xpath + '/a'))
-        WebDriverWait(self.driver, 30).until(
-            EC.presence_of_element_located((By.XPATH, li_xpath + '[@aria-selected="true"]'))
+        self.wait(
+            EVEC.js_condition('return xpath(args[0]);', li_xpath + '[@aria-selected="true"]'),
+            30
         )
@@ -15,17 +15,13 @@
 # evision-dl. If not, see <https://www.gnu.org/licenses/>.
 
 import logging
-import re
 
-from retry import retry
-from selenium.common.exceptions import StaleElementReferenceException
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.webdriver.support.wait import WebDriverWait
+from selenium.common.exceptions import JavascriptException, StaleElementReferenceException
 
-from ..applicant import Applicant
+from .. import expected_conditions as EVEC
+from ..applicant import Applicant, ApplicantSkippedEvent
+from ..backoff import RetryPolicy
 from ..download import ApplicantContextChangeEvent
-from ..xpath import string_literal as xpath_string
 from . import Screen
 from .application import ApplicationScreen
 from .gpo import GPOScreen
@@ -36,21 +32,50 @@ class ApplicationDetailsScreen(ApplicationScreen):
     def process(self) -> Screen:
         self.activate_tab("Personal\xa0Details")  # \xa0 = NO-BREAK SPACE
         applicant = self.extract_applicant_context()
+        if applicant.student_number in self.robot.completed:
+            self.robot.post_event(ApplicantSkippedEvent(applicant))
+            from .application_done import ApplicationDoneScreen
+            return ApplicationDoneScreen(self.robot)
+        if not self.robot.claim(applicant.student_number):
+            logger.debug("{} was claimed by another robot".format(applicant))
+            from .application_done import ApplicationDoneScreen
+            return ApplicationDoneScreen(self.robot)
         self.robot.post_event(ApplicantContextChangeEvent(applicant))
         self.activate_tab("GPO")
         return GPOScreen(self.robot)
 
-    @retry(StaleElementReferenceException)
+    # Labels of the cells in the Personal Details tables, by Applicant field.
+    # The first label that has a non-empty value wins.
+    FIELD_LABELS = {
+        'surname': ("Family Name(Surname):",),
+        'preferred_name': ("Preferred Name:", "Given Name:"),
+        'given_name': ("Given Name:",),
+        'program': ("Program:", "Programme:"),
+        'intake_term': ("Intake Term:", "Entry Term:"),
+    }
+
+    # Wait until the student number and surname appear, then collect every
+    # labelled table cell, all in one script
+    EXTRACT_CONDITION = EVEC.js_condition('''
+        var h3 = document.querySelector('h3');
+        var match = h3 && /Student No: (\\d{8})/.exec(h3.innerText);
+        if (!match) return null;
+        var fields = {};
+        document.querySelectorAll('td > strong').forEach(function (strong) {
+            var label = strong.textContent.trim();
+            if (!(label in fields)) {
+                fields[label] = strong.parentNode.innerText.replace(label, '').trim();
+            }
+        });
+        if (!(args[0] in fields)) return null;
+        return {student_number: match[1], fields: fields};
+    ''', "Family Name(Surname):")
+
+    @RetryPolicy('extract_applicant_context', (StaleElementReferenceException, JavascriptException), tries=5, initial_delay=1, max_delay=8)
     def extract_applicant_context(self) -> Applicant:
-        h3_text = self.driver.find_element(By.TAG_NAME, 'h3').text
-        student_number = re.findall(r"Student No: (\d{8})", h3_text)[0]
-        surname = self._extract_table_text("Family Name(Surname):")
-        preferred_name = self._extract_table_text("Preferred Name:") or \
-            self._extract_table_text("Given Name:")
-        return Applicant(student_number, surname, preferred_name)
-
-    def _extract_table_text(self, label:str) -> str:
-        td = WebDriverWait(self.driver, 30).until(
-            EC.presence_of_element_located((By.XPATH, '//td[strong[text()={}]]'.format(xpath_string(label))))
-        )
-        return td.text.replace(label, '', 1).strip()
+        result = self.wait(self.EXTRACT_CONDITION, 30)
+        fields = result['fields']
+        return Applicant(result['student_number'], **{
+            attr: next((fields[label] for label in labels if fields.get(label)), fields.get(labels[0]))
+            for attr, labels in self.FIELD_LABELS.items()
+        })
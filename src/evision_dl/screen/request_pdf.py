@@ -15,7 +15,7 @@
 # evision-dl. If not, see <https://www.gnu.org/licenses/>.
 
 from functools import lru_cache as memoized
-from typing import Optional
+from typing import Iterable, List, Optional
 import logging
 
 from selenium.common.exceptions import TimeoutException
@@ -29,13 +29,21 @@ from ..download import (
     PDFGenerationEvent,
     PDFGenerationFailureEvent,
     PDFGenerationSuccessEvent,
+    PDFGenerationTimeoutEvent,
 )
+from ..metrics import timed
+from ..timeouts import timeouts
 from ..xpath import string_literal as xpath_string
 from .application import Screen
-from . import Screen
+from . import Document, Screen
 
 logger = logging.getLogger(__name__)
 
+class PDFGenerationHung(TimeoutException):
+    def __init__(self, timeout: float):
+        super().__init__("PDF generation took more than {:g} s".format(timeout))
+        self.timeout = timeout
+
 class RequestPDFScreen(Screen):
 
     # On the GPO Screen
@@ -46,11 +54,18 @@ class RequestPDFScreen(Screen):
     EXIT_BUTTON = (By.XPATH, '//input[@type="button"][@value="EXIT"]')
 
     def process(self) -> Screen:
+        try:
+            return self.generate()
+        except PDFGenerationHung as e:
+            return self.abandon(e)
+
+    def generate(self) -> Screen:
         self.wait_for_dom()
 
         # These documents tend to be encrypted, such that including them would
-        # cause PDF concatenation to fail.
-        self.deselect_unwanted_docs("Language Proficiency", "GRE")
+        # cause PDF concatenation to fail.  Others may have been learned from
+        # experience.
+        self.deselect_unwanted_docs("Language Proficiency", "GRE", *self.robot.unwanted_doc_types)
 
         pdf_generation_event = self.try_generate_pdf()
         if pdf_generation_event is not None:
@@ -77,7 +92,32 @@ class RequestPDFScreen(Screen):
         from .application_done import ApplicationDoneScreen
         return ApplicationDoneScreen(self.robot)
 
-    def wait_for_dom(self) -> None:
+    def abandon(self, hung: PDFGenerationHung) -> Screen:
+        """
+        Give up on an applicant whose PDF generation seems to have hung,
+        rather than holding up the rest of the folder, by closing the window.
+        The failure is recorded, so that --resume retries the applicant.
+        """
+        logger.warning("{}; abandoning the applicant".format(hung.msg))
+        self.robot.post_event(PDFGenerationTimeoutEvent(hung.timeout))
+        application_window = WebDriverWait(self.driver, 10).until(
+            EVEC.window_closed(self.driver.close)
+        )
+        self.driver.switch_to.window(application_window.handle)
+        from .application_done import ApplicationDoneScreen
+        return ApplicationDoneScreen(self.robot)
+
+    # Whether the document list is ready, given the XPaths of the CONTINUE
+    # button and of the document checkboxes
+    DOC_LIST_READY = '''
+        var selects = document.querySelectorAll('#sitspagecontent select.sv-form-control[multiple]');
+        for (var i = 0; i < selects.length; i++) {
+            if (isVisible(selects[i])) return false;
+        }
+        return !!(xpath(args[0]) && xpath(args[1]));
+    '''
+
+    def wait_for_dom(self, timeout: float = 90) -> None:
         # This page initially contains HTML like:
         #
         # <div><div id="pdf_doc_list">
@@ -107,46 +147,80 @@ class RequestPDFScreen(Screen):
         # are appended after the DUM_FIXT.TTQ.MENSYS.4 element.
         #
         # Therefore, we must wait until that DOM manipulation finishes.
-        WebDriverWait(self.driver, 90).until(
-            EC.all_of(
-                EC.presence_of_element_located(self.CONTINUE_BUTTON),
-                EC.none_of(
-                    EC.visibility_of_any_elements_located(
-                        (By.CSS_SELECTOR, '#sitspagecontent select.sv-form-control[multiple]'),
-                    ),
-                ),
-                EC.presence_of_element_located((By.XPATH, self._doc_checkbox_list_xpath())),
-            )
+        self.wait(
+            EVEC.js_condition(self.DOC_LIST_READY, self.CONTINUE_BUTTON[1], self._doc_checkbox_list_xpath()),
+            timeout
         )
 
+    SELECT_DOCS_SCRIPT = '''
+        var checked = arguments[0], ids = arguments[1], substrings = arguments[2], others = arguments[3];
+        var docs = [];
+        document.querySelectorAll('label[class="pdf-check"]').forEach(function (label) {
+            var checkbox = label.querySelector('input[type="checkbox"]');
+            if (!checkbox || !checkbox.getAttribute('name')) return;
+            var id = checkbox.name + '"' + checkbox.value;
+            var text = label.innerText.trim();
+            var italic = (label.getAttribute('style') || '').indexOf('italic') >= 0;
+            var matched = ids.indexOf(id) >= 0 || substrings.some(function (s) { return text.indexOf(s) >= 0; });
+            var want = matched ? checked : (others === null || italic) ? checkbox.checked : others;
+            if (checkbox.checked !== want) {
+                // Click, rather than setting the property, to trigger the page's event handlers
+                checkbox.click();
+            }
+            docs.push({id: id, label: text, checked: checkbox.checked, italic: italic});
+        });
+        return docs;
+    '''
+
     def deselect_unwanted_docs(self, *partial_label_texts:str) -> None:
-        for label in self.driver.find_elements(By.XPATH, '//label'):
-            if any(bad in label.text for bad in partial_label_texts):
-                label.click()
+        self.select_docs(False, label_substrings=partial_label_texts)
+
+    def select_docs(self, checked: bool, ids: Iterable[str] = (), label_substrings: Iterable[str] = (), others: Optional[bool] = None) -> List[Document]:
+        """
+        In one script, check or uncheck the documents with the given ids, or
+        whose labels contain any of the given substrings.  If others is not
+        None, also check or uncheck all other (non-italic) documents
+        accordingly.  Returns the resulting state of the document list.
+        """
+        docs = self.driver.execute_script(self.SELECT_DOCS_SCRIPT, checked, list(ids), list(label_substrings), others)
+        return [Document(d['id'], d['label'], d['checked'], d['italic']) for d in docs]
 
     def try_generate_pdf(self) -> Optional[PDFGenerationEvent]:
         self.click(self.CONTINUE_BUTTON)
 
         # Wait for the "Select order of Document Types" page to render, as
         # evidenced by the presence of a "BACK" button
-        WebDriverWait(self.driver, 300).until(EC.presence_of_element_located(
-            self.BACK_BUTTON
-        ))
+        self.wait(EVEC.js_condition('return xpath(args[0]);', self.BACK_BUTTON[1]), 300)
 
         # ... but actually click on the "CONTINUE" button
         self.click(self.CONTINUE_BUTTON)
         return self.extract_pdf()
 
+    @timed('extract_pdf_seconds')
     def extract_pdf(self) -> Optional[PDFGenerationEvent]:
-        WebDriverWait(self.driver, 3600).until(EC.invisibility_of_element_located(self.CONTINUE_BUTTON))
+        # eVision can take a very long time to merge the PDF, but if it takes
+        # much longer than usual, it has probably hung
         try:
-            WebDriverWait(self.driver, 30).until(
-                EC.any_of(
-                    EC.presence_of_element_located((By.LINK_TEXT, "click here")),
-                    EC.presence_of_element_located((By.XPATH, '//*[font[@color="red"]]')),
-                    EC.text_to_be_present_in_element((By.CSS_SELECTOR, '#sitspagecontent div'), "Please to download a copy of the document"),
-                    EC.text_to_be_present_in_element((By.CSS_SELECTOR, 'p'), "Error details"),
+            with timeouts.measure('pdf_generation') as timeout:
+                self.wait(
+                    EVEC.js_condition('return !isVisible(xpath(args[0]));', self.CONTINUE_BUTTON[1]),
+                    timeout
                 )
+        except TimeoutException:
+            raise PDFGenerationHung(timeout)
+        try:
+            self.wait(
+                EVEC.js_condition('''
+                    var textOf = function (selector) {
+                        var el = document.querySelector(selector);
+                        return el ? el.textContent : '';
+                    };
+                    return xpath('//a[normalize-space(.)="click here"]')
+                        || xpath('//*[font[@color="red"]]')
+                        || textOf('#sitspagecontent div').indexOf("Please to download a copy of the document") >= 0
+                        || textOf('p').indexOf("Error details") >= 0;
+                '''),
+                30
             )
         except TimeoutException:
             # Ideally we want to see one of the known types of result pages,
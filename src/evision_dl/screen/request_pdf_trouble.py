@@ -15,8 +15,9 @@
 # evision-dl. If not, see <https://www.gnu.org/licenses/>.
 
 import logging
-from typing import List, Optional
+from typing import Dict, List, Optional, Sequence
 
+from selenium.common.exceptions import TimeoutException
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.support.wait import WebDriverWait
@@ -35,19 +36,37 @@ logger = logging.getLogger(__name__)
 
 class RequestPDFTroubleshootingScreen(RequestPDFScreen):
 
-    def process(self) -> Screen:
+    # The result page leads BACK to the "Select order of Document Types"
+    # page, which leads BACK to the document list
+    MAX_BACK_STEPS = 2
+    BACK_TIMEOUT = 10
+
+    # After going BACK, whether the document list is ready, or the page has
+    # another BACK button to follow
+    BACK_DESTINATION = EVEC.js_condition(
+        'if ((function () {' + RequestPDFScreen.DOC_LIST_READY + '})()) return "doc list";\n'
+        'return xpath(args[2]) ? "back" : false;',
+        RequestPDFScreen.CONTINUE_BUTTON[1],
+        RequestPDFScreen._doc_checkbox_list_xpath(),
+        RequestPDFScreen.BACK_BUTTON[1],
+    )
+
+    def generate(self) -> Screen:
         self.wait_for_dom()
 
         self.docs = self._parse_doc_list()
         logger.debug("Documents available: {}".format(list(self.docs.values())))
 
+        self.generation_rounds = 0
         problematic_doc_ids = self.detect_problematic_docs()
+        logger.info("Isolated {} problematic of {} documents in {} PDF generation rounds".format(
+            len(problematic_doc_ids), len(self.docs), self.generation_rounds
+        ))
         problematic_doc_names = [self.docs[d] for d in problematic_doc_ids]
         logger.warning("Problematic documents: {}".format(problematic_doc_names))
-        self.robot.post_event(PDFGenerationCaveatEvent(problematic_doc_names))
+        self.robot.post_event(PDFGenerationCaveatEvent(problematic_doc_names, list(self.docs.values())))
 
-        for doc_id in problematic_doc_ids:
-            self.deselect_doc_by_id(doc_id)
+        self.select_docs(False, ids=problematic_doc_ids, others=True)
 
         # Pretty sure it should work now, though errors are not 100% deterministic
         pdf_generation_event = self.try_generate_pdf() or \
@@ -62,28 +81,75 @@ class RequestPDFTroubleshootingScreen(RequestPDFScreen):
         return ApplicationDoneScreen(self.robot)
 
     def detect_problematic_docs(self) -> List[str]:
-        return [
-            doc_id for doc_id in self.docs
-            if self.detect_problematic_doc(doc_id)
-        ]
-
-    def detect_problematic_doc(self, doc_id:str) -> bool:
-        # Deselect all docs except the one we are testing
-        for doc in self.docs:
-            if doc != doc_id:
-                self.deselect_doc_by_id(doc)
+        # Usually, only one or two documents are problematic, so rather than
+        # testing each document individually, bisect the document list,
+        # discarding any half that produces a PDF successfully.  We already
+        # know that the whole list fails.
+        return self._bisect_problematic_docs(list(self.docs), known_bad=True)
+
+    def _bisect_problematic_docs(self, doc_ids: Sequence[str], known_bad: bool = False) -> List[str]:
+        if not doc_ids:
+            return []
+        if not known_bad and not self.detect_problematic_subset(doc_ids):
+            return []
+        if len(doc_ids) == 1:
+            return list(doc_ids)
+        left, right = doc_ids[:len(doc_ids) // 2], doc_ids[len(doc_ids) // 2:]
+        problematic = self._bisect_problematic_docs(left)
+        # If the left half is fine, then the problem must lie in the right half
+        return problematic + self._bisect_problematic_docs(right, known_bad=not problematic)
+
+    def detect_problematic_subset(self, doc_ids: Sequence[str]) -> bool:
+        # Deselect all docs except the ones we are testing
+        selection = self.select_docs(True, ids=doc_ids, others=False)
+        if {doc.id for doc in selection if doc.checked} != set(doc_ids):
+            logger.warning("Failed to select only documents {}".format(list(doc_ids)))
         pdf_generation_event = self.try_generate_pdf()
         if isinstance(pdf_generation_event, PDFGenerationSuccessEvent):
-            logger.debug("Document {} is OK".format(doc_id))
+            logger.debug("Documents {} are OK".format(list(doc_ids)))
             return False
         else:
-            logger.debug("Document {} is not OK".format(doc_id))
+            logger.debug("Documents {} are not OK".format(list(doc_ids)))
             return True
 
     def try_generate_pdf(self) -> Optional[PDFGenerationEvent]:
+        self.generation_rounds += 1
         pdf_generation_event = super().try_generate_pdf()
 
-        # Got our result.  Close the result window and reopen it.
+        # Got our result.  Going BACK within the window is much quicker than
+        # closing and reopening it, if eVision cooperates.
+        if not self._return_to_doc_list():
+            self._reopen_window()
+        return pdf_generation_event
+
+    def _return_to_doc_list(self) -> bool:
+        for _ in range(self.MAX_BACK_STEPS):
+            if not self.driver.find_elements(*self.BACK_BUTTON):
+                logger.debug("No BACK button; reopening window")
+                return False
+            page = self.driver.find_element(By.TAG_NAME, 'html')
+            self.click(self.BACK_BUTTON)
+            try:
+                WebDriverWait(self.driver, self.BACK_TIMEOUT).until(EC.staleness_of(page))
+            except TimeoutException:
+                logger.debug("BACK button had no effect; reopening window")
+                return False
+            try:
+                destination = self.wait(self.BACK_DESTINATION, self.BACK_TIMEOUT)
+            except TimeoutException:
+                logger.debug("Page after BACK is unrecognized; reopening window")
+                return False
+            if destination != "doc list":
+                continue
+            docs = self._parse_doc_list()
+            if docs != self.docs:
+                logger.debug("Documents listed after BACK changed to {}; reopening window".format(docs))
+                return False
+            return True
+        logger.debug("Failed to go BACK to the document list; reopening window")
+        return False
+
+    def _reopen_window(self) -> None:
         application_window = WebDriverWait(self.driver, 10).until(
             EVEC.window_closed(lambda: self.click(self.EXIT_BUTTON))
         )
@@ -103,16 +169,5 @@ class RequestPDFTroubleshootingScreen(RequestPDFScreen):
         if docs != self.docs:
             logger.warning("Documents available changed to: {}".format(docs))
 
-        return pdf_generation_event
-
-    def deselect_doc_by_id(self, doc_id:str):
-        self.driver.find_element(By.XPATH, self._doc_checkbox_list_xpath(doc_id)).click()
-
-    def _parse_doc_list(self):
-        labels = self.driver.find_elements(By.XPATH, self._doc_checkbox_list_xpath())
-        descriptions = [label.text.strip() for label in labels]
-        ids = [
-            checkbox.get_attribute('name') + '"' + checkbox.get_attribute('value')
-            for checkbox in self.driver.find_elements(By.XPATH, self._doc_checkbox_list_xpath() + '/input')
-        ]
-        return dict(zip(ids, descriptions))
+    def _parse_doc_list(self) -> Dict[str, str]:
+        return self.snapshot().doc_ids()
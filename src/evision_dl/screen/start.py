@@ -15,18 +15,30 @@
 # evision-dl. If not, see <https://www.gnu.org/licenses/>.
 
 import logging
+from typing import TYPE_CHECKING
 
 from selenium.webdriver.support import expected_conditions as EC
 
 from ..screen import Screen
 from .application_details import ApplicationDetailsScreen
+if TYPE_CHECKING:
+    from ..robot import Robot
 
 logger = logging.getLogger(__name__)
 
 class StartScreen(Screen):
+    URL = 'https://evision.as.it.ubc.ca/'
+
+    def __init__(self, robot: 'Robot', url: str = URL):
+        super().__init__(robot)
+        self.url = url
+
     def process(self):
-        self.driver.get('https://evision.as.it.ubc.ca/')
+        self.driver.get(self.url)
         logger.info("Waiting for user to log into eVision, bring up folder, and open the application of interest.")
         self.open_window(expectation=EC.title_is("Graduate Admissions Decision Processing"))
         logger.info("Detected application window; starting automation")
+        # With a persistent profile, the session may survive a restart, in
+        # which case this URL lets the robot skip the manual steps
+        logger.info("Application window URL: {}".format(self.driver.current_url))
         return ApplicationDetailsScreen(self.robot)
@@ -0,0 +1,145 @@
+# Copyright 2003 Dara Poon and the University of British Columbia
+#
+# This file is part of evision-dl.
+#
+# evision-dl is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# evision-dl is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# evision-dl. If not, see <https://www.gnu.org/licenses/>.
+
+from contextlib import contextmanager
+from http.client import (
+    HTTPConnection,
+    HTTPException,
+    HTTPResponse,
+    HTTPSConnection,
+)
+import logging
+from threading import BoundedSemaphore, Lock
+from typing import Dict, Iterator, List, Sequence, Tuple
+from urllib.error import HTTPError
+from urllib.parse import urljoin, urlsplit
+
+logger = logging.getLogger(__name__)
+
+HostKey = Tuple[str, str, int]
+
+class HTTPSession:
+    """
+    A minimal HTTP client that keeps connections alive between requests, so
+    that downloading many PDFs from the same server doesn't cost a TCP and
+    TLS handshake each time.  It is safe to share between threads; at most
+    max_connections_per_host connections are open to any one host.
+    """
+
+    MAX_REDIRECTS = 5
+
+    # Headers that are not passed on when redirected to another origin
+    CREDENTIAL_HEADERS = ('authorization', 'cookie')
+
+    def __init__(self, max_connections_per_host: int = 2, timeout: float = 60):
+        self.max_connections_per_host = max_connections_per_host
+        self.timeout = timeout
+        self._lock = Lock()
+        self._idle: Dict[HostKey, List[HTTPConnection]] = {}
+        self._slots: Dict[HostKey, BoundedSemaphore] = {}
+
+    @contextmanager
+    def open(self, url: str, headers: Sequence[Tuple[str, str]] = ()) -> Iterator[HTTPResponse]:
+        """
+        GET the URL, following redirects, and yield the response.  Like
+        urllib, raise HTTPError for an error status.  Credentials are not
+        sent after a redirect to a different scheme, host, or port.
+        """
+        origin = None
+        for _ in range(self.MAX_REDIRECTS + 1):
+            parts = urlsplit(url)
+            key = (parts.scheme, parts.hostname or '', parts.port or (443 if parts.scheme == 'https' else 80))
+            if origin is None:
+                origin = key
+            elif key != origin:
+                headers = [(name, value) for name, value in headers if name.lower() not in self.CREDENTIAL_HEADERS]
+            path = parts.path or '/'
+            if parts.query:
+                path += '?' + parts.query
+            slot = self._slot(key)
+            slot.acquire()
+            try:
+                conn, res = self._request(key, path, headers)
+                if res.status in (301, 302, 303, 307, 308) and res.getheader('Location'):
+                    res.read()
+                    self._release(key, conn, res)
+                    url = urljoin(url, res.getheader('Location'))
+                    logger.debug("Redirected to {}".format(url))
+                    continue
+                if res.status >= 400:
+                    conn.close()
+                    raise HTTPError(url, res.status, res.reason, res.headers, None)
+                try:
+                    yield res
+                finally:
+                    self._release(key, conn, res)
+                return
+            finally:
+                slot.release()
+        raise HTTPException("Too many redirects for {}".format(url))
+
+    def close(self) -> None:
+        with self._lock:
+            for conns in self._idle.values():
+                for conn in conns:
+                    conn.close()
+            self._idle.clear()
+
+    def _slot(self, key: HostKey) -> BoundedSemaphore:
+        with self._lock:
+            if key not in self._slots:
+                self._slots[key] = BoundedSemaphore(self.max_connections_per_host)
+            return self._slots[key]
+
+    def _request(self, key: HostKey, path: str, headers: Sequence[Tuple[str, str]]) -> Tuple[HTTPConnection, HTTPResponse]:
+        with self._lock:
+            idle = self._idle.get(key)
+            conn = idle.pop() if idle else None
+        if conn is not None:
+            try:
+                return conn, self._send(conn, path, headers)
+            except (HTTPException, ConnectionError):
+                # The server closed the kept-alive connection; start afresh
+                logger.debug("Reconnecting to {}".format(key[1]))
+                conn.close()
+        conn = self._connect(key)
+        try:
+            return conn, self._send(conn, path, headers)
+        except Exception:
+            conn.close()
+            raise
+
+    def _connect(self, key: HostKey) -> HTTPConnection:
+        scheme, host, port = key
+        logger.debug("Connecting to {}:{}".format(host, port))
+        if scheme == 'https':
+            return HTTPSConnection(host, port, timeout=self.timeout)
+        else:
+            return HTTPConnection(host, port, timeout=self.timeout)
+
+    @staticmethod
+    def _send(conn: HTTPConnection, path: str, headers: Sequence[Tuple[str, str]]) -> HTTPResponse:
+        conn.request('GET', path, headers=dict(headers))
+        return conn.getresponse()
+
+    def _release(self, key: HostKey, conn: HTTPConnection, res: HTTPResponse) -> None:
+        # A connection can only be reused if the response was read to the end
+        if res.isclosed() and not res.will_close:
+            with self._lock:
+                self._idle.setdefault(key, []).append(conn)
+        else:
+            res.close()
+            conn.close()
@@ -15,10 +15,9 @@
 # evision-dl. If not, see <https://www.gnu.org/licenses/>.
 
 import logging
-from logging.handlers import MemoryHandler
-from typing import Any, List, Optional, Tuple, Union
+from typing import Any, Dict, List, Optional, Tuple, Union
 
-from .applicant import Applicant, ApplicantContextChangeEvent
+from .applicant import Applicant, ApplicantContextChangeEvent, ApplicantSkippedEvent
 from .download import (
     PDFFailureEvent,
     PDFGenerationCaveatEvent,
@@ -27,45 +26,73 @@ from .download import (
     PDFDownloadSuccessEvent,
 )
 from .event import Event, EventListener
+from .logging import AsyncLogPipeline
 from .robot import Robot, RobotFinishingEvent
 
 logger = logging.getLogger(__name__)
 
 class Summarizer(EventListener):
-    def __init__(self, debug_log_replay_handler: Optional[MemoryHandler] = None):
-        self.debug_log_replay_handler = debug_log_replay_handler
-        self.current_applicant = None
-        self.successes: List[Tuple[Any, PDFDownloadSuccessEvent]] = []
+    event_types = (
+        ApplicantContextChangeEvent,
+        ApplicantSkippedEvent,
+        PDFGenerationCaveatEvent,
+        PDFGenerationFailureEvent,
+        PDFDownloadFailureEvent,
+        PDFDownloadSuccessEvent,
+        RobotFinishingEvent,
+    )
+
+    def __init__(self, log_pipeline: Optional[AsyncLogPipeline] = None, robots: int = 1):
+        self.log_pipeline = log_pipeline
+        # The replay is shared by all robots, so when there are several, one
+        # moving on to its next applicant must not discard what the others
+        # have logged; the replay is then just bounded by its capacity
+        self.discard_replay_per_applicant = robots == 1
+        # The applicant being processed by each robot
+        self.current_applicants: Dict[Robot, Optional[Applicant]] = {}
+        # Only failures and caveats are recapped, so successes are just counted
+        self.successes = 0
         self.caveats: List[Tuple[Any, PDFGenerationCaveatEvent]] = []
         self.failures: List[Tuple[Any, PDFFailureEvent]] = []
+        self.skipped = 0
 
     def handle_event(self, robot:Robot, event:Event) -> None:
         if isinstance(event, ApplicantContextChangeEvent):
-            self.discard_debug_log()
-            self.current_applicant = event.applicant
+            if self.discard_replay_per_applicant:
+                self.discard_debug_log()
+            self.current_applicants[robot] = event.applicant
+        elif isinstance(event, ApplicantSkippedEvent):
+            self.skipped += 1
         elif isinstance(event, PDFGenerationCaveatEvent):
-            self.caveats.append((self.current_applicant, event))
+            self.caveats.append((self.current_applicants.get(robot), event))
         elif isinstance(event, PDFGenerationFailureEvent):
-            self.failures.append((self.current_applicant, event))
+            applicant = self.current_applicants.get(robot)
+            assert applicant is not None
+            self.failures.append((applicant, event))
         elif isinstance(event, PDFDownloadFailureEvent):
-            self.failures.append((self.current_applicant, event))
+            # Downloads finish in the background, possibly after the robot has
+            # moved on to another applicant
+            self.failures.append((event.applicant, event))
         elif isinstance(event, PDFDownloadSuccessEvent):
-            self.successes.append((self.current_applicant, event))
+            self.successes += 1
         elif isinstance(event, RobotFinishingEvent):
             if event.exception:
                 self.emit_debug_log()
                 # If we are crashing with an exception while there is a current
                 # applicant context that hasn't been cleared yet, we should count
                 # the current applicant as a failure.
-                if self.current_applicant:
-                    self.failures.append((self.current_applicant, PDFFailureEvent("crashed")))
+                for applicant in self.current_applicants.values():
+                    if applicant:
+                        self.failures.append((applicant, PDFFailureEvent("crashed")))
             self.output_summary()
             self.discard_debug_log(impending_shutdown=True)
 
     def output_summary(self) -> None:
         logger.info("Downloaded {} PDFs successfully and {} unsuccessfully".format(
-            len(self.successes), len(self.failures)
+            self.successes, len(self.failures)
         ))
+        if self.skipped:
+            logger.info("Skipped {} applicants whose PDFs were already downloaded".format(self.skipped))
         if self.caveats:
             logger.warning("Caveats:")
             for applicant, event in self.caveats:
@@ -76,12 +103,8 @@ class Summarizer(EventListener):
                 logger.error("{}".format(applicant))
 
     def discard_debug_log(self, impending_shutdown: bool = False) -> None:
-        if self.debug_log_replay_handler:
-            blackhole = logging.NullHandler()
-            orig_target = self.debug_log_replay_handler.target
-            self.debug_log_replay_handler.setTarget(blackhole)
-            self.debug_log_replay_handler.flush()
-            self.debug_log_replay_handler.setTarget(orig_target)
+        if self.log_pipeline:
+            self.log_pipeline.discard_replay()
 
             # Pessimistically log this text, which might get emitted as an
             # explanatory header of an instant replay
@@ -95,11 +118,11 @@ class Summarizer(EventListener):
                 )
 
     def emit_debug_log(self) -> None:
-        if self.debug_log_replay_handler:
+        if self.log_pipeline:
             logger.debug(
                 '\n' +
                 '^' * 72 + '\n' +
                 "End instant replay of log messages\n" +
                 '#' * 72
             )
-            self.debug_log_replay_handler.flush()
\ No newline at end of file
+            self.log_pipeline.replay()
\ No newline at end of file
@@ -0,0 +1,129 @@
+# Copyright 2003 Dara Poon and the University of British Columbia
+#
+# This file is part of evision-dl.
+#
+# evision-dl is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# evision-dl is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# evision-dl. If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Timeouts for the robot's waits, learned from how long those waits have taken,
+in this run and, if saved, in previous runs.
+"""
+
+from contextlib import contextmanager
+import json
+import logging
+import os
+from threading import Lock
+import time
+from typing import Dict, Iterator, NamedTuple
+
+from .metrics import BUCKETS, Histogram
+
+logger = logging.getLogger(__name__)
+
+class Phase(NamedTuple):
+    # Timeout until enough latencies have been observed
+    default: float
+    floor: float
+    ceiling: float
+
+######################################################################
+
+class AdaptiveTimeouts:
+    """
+    The timeout for each phase is the given quantile of the latencies of its
+    successful waits, multiplied by the safety factor, and clamped between the
+    phase's floor and ceiling.  Until min_samples latencies have been
+    observed, the phase's default applies.
+    """
+
+    # Only waits whose timeout the robot can recover from, by abandoning the
+    # applicant, are learned; a shorter timeout anywhere else would crash
+    # the run, so those waits keep their fixed, generous timeouts.
+    PHASES = {
+        # Merging the PDF, which can legitimately take many minutes
+        'pdf_generation': Phase(3600, 600, 3600),
+    }
+
+    def __init__(self, quantile: float = 0.99, safety_factor: float = 3, min_samples: int = 20):
+        self.quantile = quantile
+        self.safety_factor = safety_factor
+        self.min_samples = min_samples
+        self.lock = Lock()
+        self.histograms: Dict[str, Histogram] = {phase: Histogram() for phase in self.PHASES}
+
+    def observe(self, phase: str, seconds: float) -> None:
+        with self.lock:
+            self.histograms[phase].observe(seconds)
+
+    def timeout(self, phase: str) -> float:
+        default, floor, ceiling = self.PHASES[phase]
+        with self.lock:
+            histogram = self.histograms[phase]
+            if histogram.count < self.min_samples:
+                return default
+            return min(max(histogram.quantile(self.quantile) * self.safety_factor, floor), ceiling)
+
+    @contextmanager
+    def measure(self, phase: str) -> Iterator[float]:
+        """
+        Yield the timeout for the phase, and learn from how long the block
+        took, unless it raised an exception.
+        """
+        start_time = time.monotonic()
+        yield self.timeout(phase)
+        self.observe(phase, time.monotonic() - start_time)
+
+    def load(self, path: str) -> None:
+        """
+        Add the latencies saved by a previous run, if any.  A file that can't
+        be understood is ignored, as if there had been no previous run.
+        """
+        try:
+            with open(path) as f:
+                saved = json.load(f)
+            # Check everything before adding anything
+            loaded = {
+                phase: ([int(n) for n in state['counts']], int(state['count']), float(state['sum']), float(state['max']))
+                for phase, state in saved.items()
+                if phase in self.histograms and len(state['counts']) == len(BUCKETS)
+            }
+        except FileNotFoundError:
+            return
+        except (AttributeError, KeyError, TypeError, ValueError) as e:
+            logger.warning("Ignoring timeouts file {}, which is corrupt: {!r}".format(path, e))
+            return
+        with self.lock:
+            for phase, (counts, count, sum_, max_) in loaded.items():
+                histogram = self.histograms[phase]
+                histogram.counts = [a + b for a, b in zip(histogram.counts, counts)]
+                histogram.count += count
+                histogram.sum += sum_
+                histogram.max = max(histogram.max, max_)
+        logger.info("Timeouts learned from previous runs: {}".format(
+            ', '.join('{} {:.0f} s'.format(phase, self.timeout(phase)) for phase in self.PHASES)
+        ))
+
+    def save(self, path: str) -> None:
+        with self.lock:
+            state = {
+                phase: {'counts': h.counts, 'count': h.count, 'sum': h.sum, 'max': h.max}
+                for phase, h in self.histograms.items()
+            }
+        tmp_path = path + os.path.extsep + 'part'
+        with open(tmp_path, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp_path, path)
+
+# The timeouts shared by all robots
+timeouts = AdaptiveTimeouts()
@@ -0,0 +1,127 @@
+# Copyright 2003 Dara Poon and the University of British Columbia
+#
+# This file is part of evision-dl.
+#
+# evision-dl is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# evision-dl is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# evision-dl. If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Tracing of WebDriver commands, written in the Chrome trace event format, for
+viewing in chrome://tracing or https://ui.perfetto.dev/.
+"""
+
+import functools
+import json
+import logging
+import os
+from threading import Lock, current_thread
+import time
+from typing import Any, Dict, Optional
+
+from .applicant import Applicant, ApplicantContextChangeEvent
+from .event import Event, EventListener
+from .robot import Robot, RobotFinishingEvent
+
+logger = logging.getLogger(__name__)
+
+######################################################################
+
+class CommandTracer(EventListener):
+    """
+    Records every WebDriver command issued by the robots that it is attached
+    to, with the screen that issued it and the applicant being processed.
+
+    All commands, including those on WebElements and those issued while
+    polling in WebDriverWait, pass through WebDriver.execute(), so that is
+    where they are intercepted, leaving the driver itself unwrapped.
+
+    Events are appended to the file as they happen, in the JSON Array Format,
+    which the trace viewers accept even if the closing bracket is missing
+    after a crash.
+    """
+
+    event_types = (ApplicantContextChangeEvent, RobotFinishingEvent)
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = Lock()
+        self.file: Optional[Any] = open(path, 'w')
+        self.file.write('[')
+        self.separator = '\n'
+        self.pid = os.getpid()
+        self.start_time = time.perf_counter()
+        self.threads: Dict[int, str] = {}
+        self.current_applicants: Dict[Robot, Applicant] = {}
+
+    def attach(self, robot: Robot) -> None:
+        execute = robot.driver.execute
+
+        @functools.wraps(execute)
+        def traced_execute(driver_command: str, params: Optional[Dict[str, Any]] = None) -> Any:
+            start_time = time.perf_counter()
+            error = None
+            try:
+                return execute(driver_command, params)
+            except Exception as e:
+                error = type(e).__name__
+                raise
+            finally:
+                self._record(robot, driver_command, start_time, time.perf_counter(), error)
+
+        robot.driver.execute = traced_execute      # type: ignore
+
+    def handle_event(self, robot: Robot, event: Event) -> None:
+        if isinstance(event, ApplicantContextChangeEvent):
+            if event.applicant is None:
+                self.current_applicants.pop(robot, None)
+            else:
+                self.current_applicants[robot] = event.applicant
+        elif isinstance(event, RobotFinishingEvent):
+            self.close()
+
+    def close(self) -> None:
+        with self.lock:
+            if self.file is None:
+                return
+            for tid, name in self.threads.items():
+                self._write({'name': 'thread_name', 'ph': 'M', 'pid': self.pid, 'tid': tid, 'args': {'name': name}})
+            self.file.write('\n]\n')
+            self.file.close()
+            self.file = None
+        logger.info("Wrote WebDriver command trace to {}".format(self.path))
+
+    def _record(self, robot: Robot, driver_command: str, start_time: float, end_time: float, error: Optional[str]) -> None:
+        args: Dict[str, Any] = {'screen': type(robot.screen).__name__ if robot.screen else None}
+        if applicant := self.current_applicants.get(robot):
+            args['applicant'] = applicant.student_number
+        if error:
+            args['error'] = error
+        thread = current_thread()
+        with self.lock:
+            if self.file is None:
+                return
+            self.threads.setdefault(thread.ident or 0, thread.name)
+            self._write({
+                'name': driver_command,
+                'cat': 'webdriver',
+                'ph': 'X',
+                'ts': round((start_time - self.start_time) * 1e6),
+                'dur': round((end_time - start_time) * 1e6),
+                'pid': self.pid,
+                'tid': thread.ident or 0,
+                'args': args,
+            })
+
+    def _write(self, trace_event: Dict[str, Any]) -> None:
+        assert self.file is not None
+        self.file.write(self.separator + json.dumps(trace_event))
+        self.separator = ',\n'
@@ -0,0 +1,72 @@
+# Copyright 2003 Dara Poon and the University of British Columbia
+#
+# This file is part of evision-dl.
+#
+# evision-dl is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# evision-dl is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# evision-dl. If not, see <https://www.gnu.org/licenses/>.
+
+import logging
+from threading import Thread
+from typing import Callable, List, Optional, Sequence, Tuple
+
+from .robot import Robot
+from .screen import Screen
+
+logger = logging.getLogger(__name__)
+
+######################################################################
+
+def run_workers(robots: Sequence[Robot], initial_screen_class: Callable[[Robot], Screen]) -> int:
+    """
+    Run several robots, created with Robot.spawn(), each on its own thread,
+    working through the same eVision folder.  Each robot claims the applicant
+    it lands on; applicants claimed by another robot are passed over with
+    "Next Applicant", so the work is shared out without any coordination
+    beyond the claims.
+
+    The first Ctrl-C asks every robot to stop after its current screen; a
+    second Ctrl-C closes the browsers to stop them immediately.  When all
+    robots have stopped, a single RobotFinishingEvent is posted.
+    """
+    results: List[Tuple[int, Optional[Exception]]] = [(0, None)] * len(robots)
+
+    def work(i: int) -> None:
+        results[i] = robots[i].run_screens(initial_screen_class)
+
+    threads = [
+        Thread(target=work, args=(i,), name='worker-{}'.format(i + 1))
+        for i in range(len(robots))
+    ]
+    for thread in threads:
+        thread.start()
+
+    interrupted = 0
+    while any(thread.is_alive() for thread in threads):
+        try:
+            for thread in threads:
+                thread.join(timeout=0.5)
+        except KeyboardInterrupt:
+            interrupted += 1
+            robots[0].stop_requested.set()
+            if interrupted == 1:
+                logger.error("Keyboard interrupt; stopping all workers after their current screen")
+            else:
+                logger.error("Keyboard interrupt; closing all browsers")
+                for robot in robots:
+                    try:
+                        robot.driver.quit()
+                    except Exception:
+                        pass
+
+    exception = next((e for _, e in results if e is not None), None)
+    robots[0].finish(exception)
+    return 2 if interrupted else max(status for status, _ in results)
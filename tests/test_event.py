@@ -0,0 +1,57 @@
+import pytest
+
+from evision_dl.event import Event, EventBus, EventListener
+
+class First(Event):
+    pass
+
+class Second(Event):
+    pass
+
+class Recorder(EventListener):
+    def __init__(self, log, name):
+        self.log = log
+        self.name = name
+
+    def handle_event(self, robot, event):
+        self.log.append((self.name, type(event).__name__))
+
+class Poster(Recorder):
+    """Posts a Second event while handling the First."""
+    def __init__(self, log, name, bus, fail=False):
+        super().__init__(log, name)
+        self.bus = bus
+        self.fail = fail
+
+    def handle_event(self, robot, event):
+        super().handle_event(robot, event)
+        if isinstance(event, First):
+            self.bus.dispatch(robot, Second())
+            if self.fail:
+                raise RuntimeError("listener failed")
+
+def test_reentrant_event_reaches_every_listener_after_current_event():
+    log = []
+    bus = EventBus()
+    bus.subscribe(Recorder(log, 'a'))
+    bus.subscribe(Poster(log, 'b', bus))
+    bus.subscribe(Recorder(log, 'c'))
+    bus.dispatch(None, First())
+    assert log == [
+        ('a', 'First'), ('b', 'First'), ('c', 'First'),
+        ('a', 'Second'), ('b', 'Second'), ('c', 'Second'),
+    ]
+
+def test_failing_listener_does_not_hold_back_queued_events():
+    log = []
+    bus = EventBus()
+    bus.subscribe(Poster(log, 'a', bus, fail=True))
+    bus.subscribe(Recorder(log, 'b'))
+    with pytest.raises(RuntimeError):
+        bus.dispatch(None, First())
+    assert log == [('a', 'First'), ('b', 'First'), ('a', 'Second'), ('b', 'Second')]
+
+    # Nothing is left over for the next dispatch
+    log.clear()
+    bus.dispatch(None, Second())
+    assert log == [('a', 'Second'), ('b', 'Second')]